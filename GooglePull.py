@@ -1,34 +1,78 @@
-import io
+import json
 import hashlib
+import mmap
 import os
 import time
+import random
+import email.utils
+import http.client
+import http.server
+import ssl
 import configparser
 import pickle
+import sqlite3
 import logging
+import logging.handlers
+import atexit
+import queue
+import threading
 import concurrent.futures
 import traceback
 import urllib.parse
+import httplib2
+import google_auth_httplib2
 from tqdm import tqdm
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.http import MediaIoBaseDownload, build_http
 from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from pathlib import Path
+from collections import deque, defaultdict
 from functools import lru_cache
 
+class JsonFormatter(logging.Formatter):
+    """
+    Format each record as one JSON object per line, for log shippers and jq.
+    """
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        return json.dumps(entry, default=str)
+
 def setup_logging(config):
     """
-    Configure the logging settings with timestamps.
+    Configure logging to a file written by a background thread.
+
+    Logging calls only put the record on a queue; a QueueListener thread
+    formats it (JSON lines by default, or the classic text format) and does
+    the file I/O, so debug logging doesn't stall download workers on disk
+    writes. The listener is stopped, flushing the queue, at exit.
     """
     log_format = '%(asctime)s - %(levelname)s - %(message)s'  # Added timestamps
     level = config.get('log_level', 'INFO')
     filename = config.get('log_file', 'debug.log')
     encoding = config.get('log_encoding', 'utf-8')
-    logging.basicConfig(level=logging.getLevelName(level),
-                        handlers=[logging.FileHandler(filename, 'w', encoding)],
-                        format=log_format)  # Added format with timestamps
+    file_handler = logging.FileHandler(filename, 'w', encoding)
+    if config.get('log_style', 'json') == 'json':
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(log_format))
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))  # layout is left to the listener's formatter
+    logging.basicConfig(level=logging.getLevelName(level), handlers=[queue_handler])
     logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.ERROR)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
 
 def read_config(file='config.ini'):
     config = configparser.ConfigParser()
@@ -44,72 +88,1573 @@ def handle_http_error(func):
             return []
     return wrapper
 
-def handle_http_error_with_exponential_backoff(func):
+def is_rate_limited(error):
     """
-    Wrapper for functions that make Google API calls to handle HttpError and perform exponential backoff.
+    True for responses that mean "slow down": 429, and 403 with a rate-limit reason.
     """
-    max_retry = read_config().get('max_retry', 20)
+    if error.resp.status == 429:
+        return True
+    return error.resp.status == 403 and b'ateLimitExceeded' in (error.content or b'')
 
-    def wrapper(*args, **kwargs):
-        for retry in range(max_retry):
-            try:
-                return func(*args, **kwargs)
-            except HttpError as error:
-                if error.resp.status in [403, 429, 500, 503]:  # errors indicating rate limit
-                    sleep_time = 2**retry  # exponential backoff
-                    logging.warning(f"Rate limit exceeded, retrying in {sleep_time} seconds...")
-                    time.sleep(sleep_time)
+def retry_after(error):
+    """
+    Seconds requested by a Retry-After header (delta-seconds or HTTP-date), or None.
+    """
+    value = error.resp.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RetryPolicy:
+    """
+    One place that decides which failures are retried, how often and for how long.
+
+    Transient failures are 429s, rate-limit 403s, 408/5xx responses and
+    network-level errors such as connection resets, timeouts and SSL errors.
+    Each call gets at most `max_attempts` tries; every sleep is full-jitter
+    exponential (or Retry-After) capped at `max_sleep` seconds; and the total
+    time spent backing off across the whole run is limited to `budget`
+    seconds, after which failures are raised straight away.
+    """
+    TRANSIENT_STATUSES = (408, 500, 502, 503, 504)
+    TRANSIENT_ERRORS = (ConnectionError, TimeoutError, ssl.SSLError, http.client.HTTPException,
+                        httplib2.HttpLib2Error)
+
+    def __init__(self, max_attempts=5, max_sleep=60.0, budget=1800.0, base_delay=1.0):
+        self.lock = threading.Lock()
+        self.configure(max_attempts, max_sleep, budget, base_delay)
+
+    def configure(self, max_attempts=5, max_sleep=60.0, budget=1800.0, base_delay=1.0):
+        with self.lock:
+            self.max_attempts = max_attempts
+            self.max_sleep = max_sleep
+            self.budget = budget
+            self.base_delay = base_delay
+            self.spent = 0.0
+
+    def is_transient(self, error):
+        if isinstance(error, HttpError):
+            return is_rate_limited(error) or error.resp.status in self.TRANSIENT_STATUSES
+        return isinstance(error, self.TRANSIENT_ERRORS)
+
+    def delay(self, attempt, requested=None):
+        if requested is None:
+            requested = random.uniform(0, self.base_delay * 2**attempt)
+        return min(self.max_sleep, requested)
+
+    def spend(self, seconds):
+        """
+        Charge a sleep against the run's retry budget; False once the budget is used up.
+        """
+        with self.lock:
+            if self.spent + seconds > self.budget:
+                return False
+            self.spent += seconds
+            return True
+
+retry_policy = RetryPolicy()
+
+class RateLimiter:
+    """
+    Process-wide gate that every Drive API call goes through.
+
+    The number of calls allowed in flight adapts AIMD-style: each success adds
+    1/limit (about +1 per limit's worth of successes) and each rate-limit
+    response halves it. A rate-limit response also starts a cooldown that
+    every caller waits out, so parallel workers converge on the quota ceiling
+    instead of stampeding.
+    """
+    def __init__(self, max_concurrency=16, min_concurrency=1):
+        self.condition = threading.Condition()
+        self.configure(max_concurrency, min_concurrency)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+
+    def configure(self, max_concurrency=16, min_concurrency=1):
+        with self.condition:
+            self.max_concurrency = max_concurrency
+            self.min_concurrency = min_concurrency
+            self.limit = float(max_concurrency)
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.cooldown_until - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                elif self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
                 else:
-                    raise  # if the HttpError is not due to rate limit, re-raise the exception
-            except Exception as e:
-                logging.error(f"An unexpected error occurred: {e}")
-        logging.error("Exceeded maximum retry attempts.")
-    return wrapper
+                    self.condition.wait()
+
+    def release(self, success=True):
+        with self.condition:
+            self.in_flight -= 1
+            if success:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def throttle(self, delay, budget=None):
+        """
+        Record a rate-limit response: halve allowed concurrency and start a shared cooldown.
+
+        A burst of concurrent calls tends to be rejected together, so the limit
+        is cut at most once per cooldown window; responses arriving while a
+        cooldown is already running only extend it. With a `budget`
+        (RetryPolicy), only the time the cooldown is actually extended by is
+        charged, once for all the callers waiting it out; returns False, leaving
+        the cooldown untouched, when the budget can't cover it.
+        """
+        with self.condition:
+            now = time.monotonic()
+            extension = max(0.0, now + delay - max(now, self.cooldown_until))
+            if budget is not None and extension and not budget.spend(extension):
+                return False
+            decrease = now >= self.cooldown_until
+            if decrease:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+            self.cooldown_until = max(self.cooldown_until, now + delay)
+            self.condition.notify_all()
+        if decrease:
+            logging.warning(f"Rate limit exceeded, pausing API calls for {delay:.1f} seconds "
+                            f"(concurrency now {int(self.limit)})...")
+        return True
+
+limiter = RateLimiter()
+
+class QuotaTracker:
+    """
+    Client-side accounting of Drive queries against the per-minute quotas.
+
+    Every call is counted per category (list, get, get_media, export_media, delete)
+    in a sliding one-minute window. When `qpm` is set, a token bucket that
+    refills at qpm/60 per second, holding at most `burst` seconds' worth,
+    paces callers before Google starts answering userRateLimitExceeded. Batch
+    requests are charged one token per inner request, as Google counts them.
+    """
+    WINDOW = 60.0
+
+    def __init__(self, qpm=0, burst=10.0):
+        self.lock = threading.Lock()
+        self.calls = defaultdict(deque)  # category -> deque of (timestamp, cost)
+        self.totals = defaultdict(int)
+        self.configure(qpm, burst)
+
+    def configure(self, qpm=0, burst=10.0):
+        with self.lock:
+            self.qpm = qpm
+            self.capacity = max(1.0, qpm / 60 * burst)
+            self.tokens = self.capacity
+            self.refilled = time.monotonic()
+
+    def acquire(self, category, cost=1):
+        """
+        Wait for quota, then record `cost` queries in `category`.
+        """
+        while self.qpm:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.refilled) * self.qpm / 60)
+                self.refilled = now
+                if self.tokens > 0:
+                    # A large batch may overdraw the bucket; later callers wait for it to refill
+                    self.tokens -= cost
+                    break
+                wait = -self.tokens * 60 / self.qpm + 0.01
+            time.sleep(wait)
+        with self.lock:
+            now = time.monotonic()
+            self.calls[category].append((now, cost))
+            self.totals[category] += cost
+            self.expire(now)
+
+    def expire(self, now):
+        for window in self.calls.values():
+            while window and window[0][0] < now - self.WINDOW:
+                window.popleft()
+
+    def per_minute(self):
+        """
+        Queries made in the last minute, by category.
+        """
+        with self.lock:
+            self.expire(time.monotonic())
+            return {category: sum(cost for _, cost in window) for category, window in self.calls.items()}
+
+quota = QuotaTracker()
+
+class Metrics:
+    """
+    Process-wide counters, gauges and histograms in Prometheus text format.
+
+    Nothing leaves the process unless asked: serve() exposes /metrics on a
+    local HTTP port and write_every() rewrites a .prom file (for the node
+    exporter's textfile collector) on a timer. A gauge may be set to a
+    callable, which is read each time the metrics are rendered.
+    """
+    TYPES = {
+        'googlepull_downloaded_bytes_total': ('counter', 'Bytes transferred from Google Drive.'),
+        'googlepull_files_total': ('counter', 'Files processed, by result.'),
+        'googlepull_deleted_items_total': ('counter', 'Items deleted from Google Drive.'),
+        'googlepull_api_calls_total': ('counter', 'Drive API calls, by operation and status.'),
+        'googlepull_api_call_duration_seconds': ('histogram', 'Drive API call latency, by operation.'),
+        'googlepull_api_retries_total': ('counter', 'Drive API calls retried after a transient error.'),
+        'googlepull_rate_limited_total': ('counter', 'Rate limit responses (429 or 403 rateLimitExceeded).'),
+        'googlepull_api_in_flight': ('gauge', 'Drive API calls currently in flight.'),
+        'googlepull_api_concurrency_limit': ('gauge', 'Drive API calls currently allowed in flight.'),
+        'googlepull_download_workers_active': ('gauge', 'Download workers currently transferring a file.'),
+        'googlepull_queue_depth': ('gauge', 'Items waiting in each pipeline queue.'),
+    }
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}  # (name, labels) -> number or callable
+        self.histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self.server = None
+        self.writer = None
+        self.stopped = threading.Event()
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[self.key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self.key(name, labels)
+        with self.lock:
+            counts = self.histograms.setdefault(key, [0] * (len(self.BUCKETS) + 2))
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    @staticmethod
+    def format_labels(labels, **extra):
+        pairs = list(labels) + list(extra.items())
+        if not pairs:
+            return ''
+        escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in pairs) + '}'
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items(), key=lambda entry: entry[0])
+            histograms = sorted((key, list(counts)) for key, counts in self.histograms.items())
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                kind, text = self.TYPES.get(name, ('untyped', ''))
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in values:
+            describe(name)
+            lines.append(f'{name}{self.format_labels(labels)} {value() if callable(value) else value}')
+        for (name, labels), counts in histograms:
+            describe(name)
+            for bound, count in zip(self.BUCKETS, counts):
+                lines.append(f'{name}_bucket{self.format_labels(labels, le=bound)} {count}')
+            lines.append(f'{name}_bucket{self.format_labels(labels, le="+Inf")} {counts[-2]}')
+            lines.append(f'{name}_sum{self.format_labels(labels)} {counts[-1]}')
+            lines.append(f'{name}_count{self.format_labels(labels)} {counts[-2]}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, address='127.0.0.1'):
+        """
+        Serve the metrics at http://address:port/metrics from a daemon thread.
+        """
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("Metrics request: " + format, *args)
+
+        self.server = http.server.ThreadingHTTPServer((address, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True).start()
+        logging.info(f"Serving metrics on http://{address}:{self.server.server_port}/metrics")
+
+    def write(self, path):
+        """
+        Atomically replace path with the current metrics, so a scraper never reads a partial file.
+        """
+        tmp = path.with_name(path.name + '.tmp')
+        tmp.write_text(self.render(), encoding='utf-8')
+        os.replace(tmp, path)
+
+    def write_every(self, path, interval=15.0):
+        path = Path(path)
+
+        def run():
+            while not self.stopped.wait(interval):
+                try:
+                    self.write(path)
+                except OSError as error:
+                    logging.warning(f"Could not write metrics to {path}: {error}")
+            self.write(path)
+        self.writer = threading.Thread(target=run, name='metrics-writer', daemon=True)
+        self.writer.start()
+
+    def close(self):
+        """
+        Stop serving and write the metrics file one last time.
+        """
+        self.stopped.set()
+        if self.writer is not None:
+            self.writer.join()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+metrics = Metrics()
+metrics.set('googlepull_api_in_flight', lambda: limiter.in_flight)
+metrics.set('googlepull_api_concurrency_limit', lambda: int(limiter.limit))
+
+class Tracer:
+    """
+    Timing spans for every Drive API call, for working out afterwards where a run's time went.
+
+    Each call becomes a span carrying its operation, file id, bytes, status
+    and retry attempt; time spent queued for quota or a concurrency slot and
+    backoff sleeps get spans of their own. Spans are written as JSON lines,
+    or in Chrome's trace-event format for chrome://tracing or Perfetto, where
+    every thread is a row. Does nothing until open() is called.
+    """
+    WAIT_THRESHOLD = 0.001  # shorter waits for quota or a slot are not worth a span
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fh = None
+        self.format = 'jsonl'
+        self.threads = set()
+        self.epoch = time.monotonic()
+        self.wall_epoch = time.time()
+
+    @property
+    def enabled(self):
+        return self.fh is not None
+
+    def open(self, path, format='jsonl'):
+        if format not in ('jsonl', 'chrome'):
+            raise ValueError(f"Unknown trace format {format!r}, expected 'jsonl' or 'chrome'")
+        with self.lock:
+            self.fh = open(path, 'w', encoding='utf-8')
+            self.format = format
+            if format == 'chrome':
+                # The array is closed on close(); trace viewers also accept it unterminated after a crash
+                self.fh.write('[\n')
+
+    def span(self, name, start, end, **args):
+        """
+        Record a span from start to end (time.monotonic() values); None-valued args are left out.
+        """
+        if self.fh is None:
+            return
+        thread = threading.current_thread()
+        args = {key: value for key, value in args.items() if value is not None}
+        with self.lock:
+            if self.fh is None:
+                return
+            if self.format == 'chrome':
+                if thread.ident not in self.threads:
+                    self.threads.add(thread.ident)
+                    self.write_event({'name': 'thread_name', 'ph': 'M', 'tid': thread.ident,
+                                      'args': {'name': thread.name}})
+                self.write_event({'name': name, 'cat': 'drive', 'ph': 'X', 'tid': thread.ident,
+                                  'ts': round((start - self.epoch) * 1e6), 'dur': round((end - start) * 1e6),
+                                  'args': args})
+            else:
+                self.fh.write(json.dumps({'op': name, 'start': round(self.wall_epoch + start - self.epoch, 6),
+                                          'duration': round(end - start, 6), 'thread': thread.name,
+                                          **args}) + '\n')
+
+    def write_event(self, event):
+        self.fh.write(json.dumps({'pid': os.getpid(), **event}) + ',\n')
+
+    def close(self):
+        with self.lock:
+            if self.fh is None:
+                return
+            if self.format == 'chrome':
+                self.fh.write(json.dumps({'name': 'process_name', 'ph': 'M', 'pid': os.getpid(),
+                                          'args': {'name': 'GooglePull'}}) + ']\n')
+            self.fh.close()
+            self.fh = None
+
+tracer = Tracer()
+
+def api_call(fn, *args, category='other', cost=1, file_id=None, **kwargs):
+    """
+    Run one Drive API call through quota pacing and the shared rate limiter,
+    retrying transient failures per retry_policy. file_id (a file or folder
+    id, or a list of them) only labels the call's trace spans.
+    """
+    attempt = 0
+    while True:
+        queued = time.monotonic()
+        quota.acquire(category, cost)
+        limiter.acquire()
+        start = time.monotonic()
+        if start - queued >= tracer.WAIT_THRESHOLD:
+            tracer.span('wait', queued, start, call=category, file_id=file_id, attempt=attempt)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as error:
+            end = time.monotonic()
+            limiter.release(success=False)
+            rate_limited = isinstance(error, HttpError) and is_rate_limited(error)
+            status = error.resp.status if isinstance(error, HttpError) else type(error).__name__
+            metrics.observe('googlepull_api_call_duration_seconds', end - start, op=category)
+            metrics.inc('googlepull_api_calls_total', op=category, status=status)
+            tracer.span(category, start, end, file_id=file_id, status=status, attempt=attempt)
+            if rate_limited:
+                metrics.inc('googlepull_rate_limited_total', op=category)
+            attempt += 1
+            if not retry_policy.is_transient(error) or attempt >= retry_policy.max_attempts:
+                raise
+            requested = retry_after(error) if isinstance(error, HttpError) else None
+            delay = retry_policy.delay(attempt, requested)
+            # Threads hitting the same rate limit share one cooldown, so it is charged once
+            charged = limiter.throttle(delay, retry_policy) if rate_limited else retry_policy.spend(delay)
+            if not charged:
+                logging.error(f"Retry budget of {retry_policy.budget:.0f} seconds used up, giving up: {error}")
+                raise
+            metrics.inc('googlepull_api_retries_total', op=category)
+            if not rate_limited:
+                logging.warning(f"Transient error ({error}), retrying in {delay:.1f} seconds...")
+                slept = time.monotonic()
+                time.sleep(delay)
+                tracer.span('backoff', slept, time.monotonic(), call=category, file_id=file_id, attempt=attempt)
+        else:
+            end = time.monotonic()
+            limiter.release()
+            metrics.observe('googlepull_api_call_duration_seconds', end - start, op=category)
+            metrics.inc('googlepull_api_calls_total', op=category, status='ok')
+            if tracer.enabled:
+                tracer.span(category, start, end, file_id=file_id, status='ok', attempt=attempt,
+                            bytes=len(result) if isinstance(result, bytes) else None,
+                            items=len(result['files']) if isinstance(result, dict) and 'files' in result else None)
+            return result
+
+def execute(request, http=None, category='other', cost=1, file_id=None):
+    """
+    Execute a googleapiclient request through api_call, optionally on a specific transport.
+    """
+    return api_call(request.execute, category=category, cost=cost, file_id=file_id, http=http)
 
-def list_sources(service, parent_id=None, resource_key=None):
-    logging.debug('Listing sources...')
+PAGE_SIZE = 1000  # files.list maximum
+ITEM_FIELDS = "id, name, md5Checksum, sha256Checksum, size, mimeType, parents"
+CHUNK_SIZE = 16 * 1024 * 1024  # bytes per media request; bounds memory per transfer
+HASH_CHUNK_SIZE = 1024 * 1024  # bytes fed to the hasher at a time when hashing local files
+MMAP_THRESHOLD = 64 * 1024 * 1024  # local files at least this large are hashed through mmap
+HASH_INDEX_NAME = '.googlepull-hashes.db'  # kept in the destination root
+JOURNAL_NAME = '.googlepull-journal.db'  # kept in the destination root
+
+# Item states recorded in the journal, in the order an item moves through them;
+# being listed is implied by the item's row in the journal's items table
+DOWNLOADED, VERIFIED, DELETED = range(1, 4)
+
+_thread_local = threading.local()
+
+def thread_http(service):
+    """
+    Return an authorized HTTP transport owned by the calling thread.
+
+    The httplib2 client behind the shared service object is not thread-safe, so
+    every worker thread gets its own connection using the same credentials.
+    build_http() applies the same socket timeout as the service's own
+    transport, so a stalled connection raises a retryable TimeoutError
+    instead of hanging the worker.
+    """
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        http = google_auth_httplib2.AuthorizedHttp(service._http.credentials, http=build_http())
+        _thread_local.http = http
+    return http
+
+def iter_pages(service, parent_id=None, resource_key=None, http=None, **scope):
+    """
+    Yield the children of parent_id one result page (a list of items) at a time, letting HttpError propagate.
+
+    parent_id may be a single folder id, a list of folder ids (combined into one
+    OR'ed `in parents` query) or None for every non-trashed item in scope. Only
+    one page is held at a time, so callers can act on the first page while
+    later ones are still being fetched.
+    """
+    parent_ids = [parent_id] if isinstance(parent_id, str) else parent_id
+    if parent_ids:
+        clauses = ' or '.join(f"'{parent}' in parents" for parent in parent_ids)
+        query = f"({clauses}) and trashed=false"
+    else:
+        query = "trashed=false"
+
+    page_token = None
+    while True:
+        results = execute(service.files().list(
+            q=query,
+            pageSize=PAGE_SIZE,
+            fields=f"nextPageToken, files({ITEM_FIELDS})",
+            pageToken=page_token,
+            **scope
+        ), http, 'list', file_id=parent_ids)
+
+        new_items = results.get('files', [])
+        logging.debug('Current items: %s', new_items)
+        for item in new_items:
+            item['resourceKey'] = resource_key
+        yield new_items
+
+        page_token = results.get('nextPageToken', None)
+        if page_token is None:
+            break
+
+def iter_sources(service, parent_id=None, resource_key=None, http=None, **scope):
+    """
+    Yield the children of parent_id one item at a time; see iter_pages().
+    """
+    for page in iter_pages(service, parent_id, resource_key, http, **scope):
+        yield from page
+
+def fetch_children(service, parent_ids, resource_key=None, http=None):
+    """
+    List the children of several folders with one OR'ed `in parents` query.
+
+    Yields a dict per result page mapping each requested parent id to its
+    children on that page, split back out locally using the `parents` field
+    of every result.
+    """
+    for page in iter_pages(service, parent_ids, resource_key, http):
+        children = defaultdict(list)
+        for item in page:
+            parent_id = next((p for p in item.get('parents', []) if p in parent_ids), None)
+            if parent_id is None:
+                logging.warning(f"Item {item['id']} returned without a requested parent, skipping.")
+                continue
+            children[parent_id].append(item)
+        yield children
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# mimeType strings interned as small integer codes; code 0 is always a folder
+MIME_TYPES = [FOLDER_MIME_TYPE]
+MIME_CODES = {FOLDER_MIME_TYPE: 0}
+
+def mime_code(mime_type):
+    code = MIME_CODES.get(mime_type)
+    if code is None:
+        code = MIME_CODES[mime_type] = len(MIME_TYPES)
+        MIME_TYPES.append(mime_type)
+    return code
+
+class DriveItem:
+    """
+    Compact manifest record for one Drive item.
+
+    The parent is an index into Manifest.records, the mimeType an interned code
+    and the checksums raw digests. On CPython 3.11 a manifest costs about
+    470 bytes per item, id index included, against roughly 980 bytes when the
+    listing dicts were kept (measured with bench_manifest.py).
+    """
+    __slots__ = ('id', 'parent', 'name', 'size', 'md5', 'sha256', 'mime', 'resource_key')
+
+    def __init__(self, id, parent, name, size=None, md5=None, sha256=None, mime=0, resource_key=None):
+        self.id = id
+        self.parent = parent
+        self.name = name
+        self.size = size  # None for Google-native files, which have no size
+        self.md5 = md5
+        self.sha256 = sha256
+        self.mime = mime
+        self.resource_key = resource_key
+
+    @classmethod
+    def from_listing(cls, item, parent):
+        size = item.get('size')
+        md5 = item.get('md5Checksum')
+        sha256 = item.get('sha256Checksum')
+        return cls(item['id'], parent, item['name'],
+                   int(size) if size is not None else None,
+                   bytes.fromhex(md5) if md5 else None,
+                   bytes.fromhex(sha256) if sha256 else None,
+                   mime_code(item['mimeType']),
+                   item.get('resourceKey'))
+
+    @property
+    def checksum(self):
+        """
+        The strongest digest Drive reported for this item, or None (e.g. Google-native files).
+        """
+        return self.sha256 or self.md5
+
+    def new_hash(self):
+        """
+        Return a fresh hash object matching `checksum`, or None when there is nothing to verify against.
+        """
+        if self.sha256:
+            return hashlib.sha256()
+        if self.md5:
+            return hashlib.md5()
+        return None
+
+    @property
+    def mime_type(self):
+        return MIME_TYPES[self.mime]
+
+    @property
+    def is_folder(self):
+        return self.mime == 0
+
+class Manifest:
+    """
+    In-memory snapshot of a Drive folder tree, built by a single crawl.
+
+    Sizes, file counts, downloads and folder cleanup are all answered from here
+    so a pull lists each folder exactly once. Items are DriveItem records
+    addressed by their position in `records`; the root folder is always 0.
+    """
+    def __init__(self, root_id, root_name, resource_key=None):
+        self.root_id = root_id
+        self.resource_key = resource_key
+        self.records = [DriveItem(root_id, None, root_name)]
+        self.index = {root_id: 0}
+        self.children = {0: []}
+        self.verified = bytearray(1)  # one flag per record: local copy matches Drive
+        self.deleted = bytearray(1)  # one flag per record: gone from Drive
+        self.incomplete = set()  # folders whose listing failed; never treated as empty
+        self.crawled_at = time.time()  # when the listing began; restored from the journal on resume
+
+    @property
+    def root(self):
+        return self.records[0]
+
+    def add(self, parent_id, item):
+        return self.append(DriveItem.from_listing(item, self.index[parent_id]))
+
+    def append(self, record):
+        position = len(self.records)
+        self.records.append(record)
+        self.index[record.id] = position
+        self.children[record.parent].append(position)
+        self.verified.append(0)
+        self.deleted.append(0)
+        if record.is_folder:
+            self.children[position] = []
+        return position
+
+    def folders(self, folder=0):
+        """
+        Yield folder positions breadth-first, starting with (and including) folder.
+        """
+        queue = deque([folder])
+        while queue:
+            current = queue.popleft()
+            yield current
+            queue.extend(child for child in self.children[current] if self.records[child].is_folder)
+
+    def files(self, folder=0):
+        """
+        Yield the position of every non-folder item below folder.
+        """
+        for current in self.folders(folder):
+            for child in self.children[current]:
+                if not self.records[child].is_folder:
+                    yield child
+
+    def total_size(self, folder=0):
+        return sum(self.records[child].size or 0 for child in self.files(folder))
+
+    def total_files(self, folder=0):
+        return sum(len(self.children[current]) for current in self.folders(folder))
+
+    def remaining(self, folder=0):
+        return [child for child in self.files(folder) if not self.deleted[child]]
+
+    def mark_deleted(self, position):
+        """
+        Flag an item as deleted from Drive; deleting a folder removes everything below it too.
+        """
+        self.deleted[position] = 1
+        if self.records[position].is_folder:
+            for folder in self.folders(position):
+                self.deleted[folder] = 1
+                for child in self.children[folder]:
+                    self.deleted[child] = 1
+
+    def deletion_roots(self):
+        """
+        The smallest set of items whose deletion removes everything verified from Drive.
+
+        A folder is complete when its listing succeeded and every descendant is
+        verified (or already deleted). The highest complete folders are returned
+        in place of their contents; verified files outside them are returned
+        individually. A root whose crawl found nothing is never returned, since
+        there is nothing verified to justify deleting it.
+        """
+        if not self.children[0]:
+            return []
+        complete = bytearray(len(self.records))
+        for folder in reversed(list(self.folders())):
+            complete[folder] = folder not in self.incomplete and all(
+                complete[child] if self.records[child].is_folder else self.verified[child] or self.deleted[child]
+                for child in self.children[folder])
+
+        roots = []
+        queue = deque([0])
+        while queue:
+            folder = queue.popleft()
+            if complete[folder]:
+                if not self.deleted[folder]:
+                    roots.append(folder)
+                continue
+            for child in self.children[folder]:
+                if self.records[child].is_folder:
+                    queue.append(child)
+                elif self.verified[child] and not self.deleted[child]:
+                    roots.append(child)
+        return roots
+
+    def dest_path(self, folder, dest_folder: Path):
+        """
+        Map a folder in the manifest to its local directory; the root maps to dest_folder itself.
+        """
+        names = []
+        while folder != 0:
+            record = self.records[folder]
+            names.append(record.name)
+            folder = record.parent
+        return dest_folder.joinpath(*reversed(names))
+
+def build_manifest(service, folder_id, name, resource_key=None, workers=1, batch_size=1, on_listed=None):
+    """
+    Crawl the tree under folder_id once, listing every folder exactly one time.
+
+    Folders are listed breadth-first with up to `workers` listings in flight;
+    discovered subfolders are fed back into the frontier queue. Each listing
+    covers up to `batch_size` frontier folders in a single query. Listing
+    threads hand every result page to the calling thread as it arrives, which
+    adds it to the manifest and, when given, calls
+    on_listed(manifest, positions) with the children it held, so neither a
+    huge folder's listing dicts nor the first downloads wait for its last page.
+    """
+    logging.debug('Building manifest for folder %s with %d workers...', folder_id, workers)
+    manifest = Manifest(folder_id, name, resource_key)
+    pages = queue.Queue()  # (group, children of one page), then (group, None or the error) when it is done
+
+    def list_folders(group):
+        key = resource_key if group == [folder_id] else None
+        try:
+            for children in fetch_children(service, group, key, http=thread_http(service)):
+                pages.put((group, children))
+        except Exception as error:
+            pages.put((group, error))
+        else:
+            pages.put((group, None))
+
+    frontier = deque([folder_id])
+    in_flight = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crawl') as executor:
+        while frontier or in_flight:
+            while frontier and in_flight < workers:
+                # Spread a small frontier across idle workers rather than batching it all into one query
+                size = min(batch_size, max(1, len(frontier) // (workers - in_flight)))
+                group = [frontier.popleft() for _ in range(min(size, len(frontier)))]
+                executor.submit(list_folders, group)
+                in_flight += 1
+
+            metrics.set('googlepull_queue_depth', len(frontier), queue='crawl')
+            group, result = pages.get()
+            if isinstance(result, dict):
+                for current, items in result.items():
+                    positions = [manifest.add(current, item) for item in items]
+                    frontier.extend(item['id'] for item in items if item['mimeType'] == FOLDER_MIME_TYPE)
+                    if on_listed is not None:
+                        on_listed(manifest, positions)
+                continue
+            in_flight -= 1
+            if isinstance(result, (HttpError,) + RetryPolicy.TRANSIENT_ERRORS):
+                # Pages that did arrive stay; the folders are only kept from being treated as complete
+                logging.error(f"Failed to list folders {group}: {result}")
+                manifest.incomplete.update(manifest.index[parent_id] for parent_id in group)
+            elif result is not None:
+                raise result
+    metrics.set('googlepull_queue_depth', 0, queue='crawl')
+
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        # Both totals walk the whole tree, so only compute them when they will be logged
+        logging.debug('Manifest built: %d items, %d bytes.', manifest.total_files(), manifest.total_size())
+    return manifest
+
+def relist_folders(service, manifest, positions, batch_size=1):
+    """
+    List folders again, e.g. after their earlier listing failed, and add any items not yet in the manifest.
+
+    Subfolders found along the way are listed as well. Folders that list
+    successfully leave manifest.incomplete; returns those that failed again.
+    """
+    http = thread_http(service)
+    frontier = deque(positions)
+    failed = set()
+    while frontier:
+        group = [frontier.popleft() for _ in range(min(batch_size, len(frontier)))]
+        parent_ids = [manifest.records[position].id for position in group]
+        key = manifest.resource_key if group == [0] else None
+        try:
+            for children in fetch_children(service, parent_ids, key, http):
+                for current, items in children.items():
+                    for item in items:
+                        if item['id'] in manifest.index:
+                            continue
+                        position = manifest.add(current, item)
+                        if manifest.records[position].is_folder:
+                            frontier.append(position)
+        except (HttpError,) + RetryPolicy.TRANSIENT_ERRORS as error:
+            logging.error(f"Failed to list folders {parent_ids}: {error}")
+            manifest.incomplete.update(group)
+            failed.update(group)
+            continue
+        manifest.incomplete.difference_update(group)
+    return failed
+
+def scan_manifest(service, folder_id, name, resource_key=None, on_listed=None):
+    """
+    Build the manifest from one linear scan of every non-trashed item in the drive.
+
+    Rather than listing folder by folder, page through the whole drive (or shared
+    drive) with `parents` included and rebuild the hierarchy under folder_id
+    locally. Costs roughly one call per PAGE_SIZE items regardless of tree shape.
+    Each page is turned into compact records as it arrives: items under
+    folder_id join the manifest (and go to on_listed) straight away, items
+    whose parent is still unknown wait for it, and the rest are dropped at
+    the end, so listing dicts never pile up for the whole drive.
+    """
+    logging.debug('Scanning drive for folder %s...', folder_id)
+    root = execute(service.files().get(fileId=folder_id, fields='id, driveId', supportsAllDrives=True),
+                   category='get', file_id=folder_id)
+    if root.get('driveId'):
+        scope = {'corpora': 'drive', 'driveId': root['driveId'],
+                 'includeItemsFromAllDrives': True, 'supportsAllDrives': True}
+    else:
+        scope = {'corpora': 'user'}
+
+    manifest = Manifest(folder_id, name, resource_key)
+    # Records whose parent hasn't been seen yet, keyed by parent id. Whatever is
+    # still parked when the scan ends lies outside folder_id and is dropped.
+    parked = defaultdict(list)
+    positions = []
+
+    def attach(parent_id, record):
+        stack = [(parent_id, record)]
+        while stack:
+            parent_id, record = stack.pop()
+            record.parent = manifest.index[parent_id]
+            record.resource_key = resource_key if parent_id == folder_id else None
+            positions.append(manifest.append(record))
+            if record.is_folder:
+                stack.extend((record.id, child) for child in reversed(parked.pop(record.id, [])))
+
+    for page in iter_pages(service, **scope):
+        for item in page:
+            if item.get('parents'):
+                parent_id = item['parents'][0]
+                record = DriveItem.from_listing(item, None)
+                if parent_id in manifest.index:
+                    attach(parent_id, record)
+                else:
+                    parked[parent_id].append(record)
+        # Hand over what each page added, so downloads start while the scan goes on
+        if positions and on_listed is not None:
+            on_listed(manifest, positions)
+        positions = []
+    logging.debug('Dropped %d items outside the folder.', sum(len(records) for records in parked.values()))
+
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        # Both totals walk the whole tree, so only compute them when they will be logged
+        logging.debug('Manifest built: %d items, %d bytes.', manifest.total_files(), manifest.total_size())
+    return manifest
+
+def crawl_manifest(service, folder_id, name, resource_key, config, on_listed=None):
+    """
+    Build the manifest using the crawl strategy selected in the config.
+    """
+    if config.get('crawl_mode', 'tree') == 'flat':
+        return scan_manifest(service, folder_id, name, resource_key, on_listed)
+    return build_manifest(service, folder_id, name, resource_key,
+                          config.getint('crawl_workers', 8), config.getint('crawl_batch_size', 25), on_listed)
+
+class ChecksumMismatch(Exception):
+    """
+    Downloaded content does not match the checksum Drive reported.
+    """
+
+class HashingWriter:
+    """
+    Write-through file wrapper that hashes bytes as they stream past, so a
+    download is verified without reading the file back.
+    """
+    def __init__(self, fh, hasher):
+        self.fh = fh
+        self.hasher = hasher
+
+    def write(self, data):
+        if self.hasher is not None:
+            self.hasher.update(data)
+        return self.fh.write(data)
+
+def hash_file(path, hasher):
+    """
+    Hash a local file in fixed-size chunks and return the digest.
+
+    Large files are memory-mapped and fed to the hasher through zero-copy
+    slices; smaller ones are read a chunk at a time. Memory use stays at one
+    chunk regardless of file size.
+    """
+    with open(path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    for offset in range(0, size, HASH_CHUNK_SIZE):
+                        hasher.update(view[offset:offset + HASH_CHUNK_SIZE])
+        else:
+            for block in iter(lambda: fh.read(HASH_CHUNK_SIZE), b''):
+                hasher.update(block)
+    return hasher.digest()
+
+class HashIndex:
+    """
+    Persistent cache of local file digests, stored as SQLite in the destination root.
+
+    Entries are keyed by relative path and only trusted while size, mtime_ns and
+    inode all still match, so an unchanged file is verified with a single stat.
+    """
+    def __init__(self, dest_folder: Path):
+        self.root = dest_folder
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(dest_folder / HASH_INDEX_NAME), check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS hashes ('
+                        'path TEXT NOT NULL, algorithm TEXT NOT NULL, size INTEGER, mtime_ns INTEGER, '
+                        'inode INTEGER, digest BLOB, PRIMARY KEY (path, algorithm))')
+
+    def key(self, path: Path):
+        return path.relative_to(self.root).as_posix()
+
+    def lookup(self, path: Path, stat, algorithm):
+        with self.lock:
+            row = self.db.execute('SELECT size, mtime_ns, inode, digest FROM hashes WHERE path = ? AND algorithm = ?',
+                                  (self.key(path), algorithm)).fetchone()
+        if row and row[:3] == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return row[3]
+        return None
+
+    def store(self, path: Path, stat, algorithm, digest):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)',
+                            (self.key(path), algorithm, stat.st_size, stat.st_mtime_ns, stat.st_ino, digest))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class Journal:
+    """
+    Checkpoint journal of a pull, stored as SQLite in the destination root.
+
+    Holds the crawled manifest plus an append-only log of item state changes
+    (downloaded, verified, deleted). A run that crashes or is killed
+    replays the log on restart and picks up only unfinished work, without
+    re-crawling Drive or re-hashing files that were already verified. The
+    crawl time is kept too, so a resumed run knows how old its listing is. Events
+    are committed at most once a second; anything lost in a crash is simply
+    redone, since every step is safe to repeat.
+    """
+    def __init__(self, dest_folder: Path, commit_interval=1.0):
+        self.lock = threading.Lock()
+        self.commit_interval = commit_interval
+        self.committed = time.monotonic()
+        self.db = sqlite3.connect(str(dest_folder / JOURNAL_NAME), check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);'
+            'CREATE TABLE IF NOT EXISTS items (position INTEGER PRIMARY KEY, id TEXT, parent INTEGER, name TEXT, '
+            'size INTEGER, md5 BLOB, sha256 BLOB, mime TEXT, resource_key TEXT);'
+            'CREATE TABLE IF NOT EXISTS incomplete (position INTEGER PRIMARY KEY);'
+            'CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, position INTEGER, state INTEGER);')
+
+    def meta(self):
+        return dict(self.db.execute('SELECT key, value FROM meta'))
+
+    def load(self, root_id):
+        """
+        Rebuild the manifest of an unfinished run for root_id, or return None.
+        """
+        with self.lock:
+            meta = self.meta()
+            if meta.get('root_id') != root_id or meta.get('status') != 'crawled':
+                return None
+            manifest = Manifest(root_id, meta['root_name'], meta.get('resource_key') or None)
+            manifest.crawled_at = float(meta.get('crawled_at') or 0)
+            rows = self.db.execute('SELECT id, parent, name, size, md5, sha256, mime, resource_key '
+                                   'FROM items WHERE position > 0 ORDER BY position')
+            for id, parent, name, size, md5, sha256, mime, resource_key in rows:
+                manifest.append(DriveItem(id, parent, name, size, md5, sha256, mime_code(mime), resource_key))
+            manifest.incomplete.update(row[0] for row in self.db.execute('SELECT position FROM incomplete'))
+            for position, state in self.db.execute('SELECT position, state FROM events ORDER BY seq'):
+                if state == VERIFIED:
+                    manifest.verified[position] = 1
+                elif state == DELETED:
+                    manifest.mark_deleted(position)
+        age = (time.time() - manifest.crawled_at) / 3600
+        logging.info(f"Replayed journal: {len(manifest.records)} items, {len(manifest.remaining())} files unfinished, "
+                     f"listed {age:.1f} hours ago.")
+        return manifest
+
+    def start(self, root_id, root_name, resource_key=None):
+        """
+        Begin a new journal for a crawl of root_id, discarding any earlier one.
+        """
+        with self.lock:
+            with self.db:
+                self.db.executescript('DELETE FROM meta; DELETE FROM items; DELETE FROM incomplete; DELETE FROM events;')
+                self.db.executemany('INSERT INTO meta VALUES (?, ?)', [
+                    ('root_id', root_id), ('root_name', root_name),
+                    ('resource_key', resource_key or ''), ('status', 'crawling')])
+            self.committed = time.monotonic()
+
+    def save_manifest(self, manifest):
+        """
+        Record the finished crawl. Events logged while it ran are kept, since downloads start before it ends.
+        """
+        with self.lock:
+            with self.db:
+                self.db.execute('DELETE FROM items')
+                self.insert_items(manifest)
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('crawled_at', ?)", (str(manifest.crawled_at),))
+                self.db.execute("UPDATE meta SET value = 'crawled' WHERE key = 'status'")
+            self.committed = time.monotonic()
+
+    def extend(self, manifest, start):
+        """
+        Record items added to the manifest from position `start` on, e.g. after relisting failed folders.
+        """
+        with self.lock:
+            with self.db:
+                self.insert_items(manifest, start)
+
+    def insert_items(self, manifest, start=0):
+        self.db.executemany('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+            (position, r.id, r.parent, r.name, r.size, r.md5, r.sha256, r.mime_type, r.resource_key)
+            for position, r in enumerate(manifest.records[start:], start)))
+        self.db.execute('DELETE FROM incomplete')
+        self.db.executemany('INSERT INTO incomplete VALUES (?)', ((p,) for p in manifest.incomplete))
+
+    def record(self, position, state):
+        with self.lock:
+            self.db.execute('INSERT INTO events (position, state) VALUES (?, ?)', (position, state))
+            if time.monotonic() - self.committed >= self.commit_interval:
+                self.db.commit()
+                self.committed = time.monotonic()
+
+    def finish(self):
+        """
+        Mark the run complete so the next pull of the same folder crawls afresh.
+        """
+        with self.lock:
+            self.db.execute("UPDATE meta SET value = 'finished' WHERE key = 'status'")
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+def local_digest(path: Path, item, hash_index=None):
+    """
+    Digest of an existing local file in the algorithm of item.checksum, or None
+    when the file is missing or its size already differs from the Drive copy.
+    """
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    if stat.st_size != item.size:
+        return None
+
+    hasher = item.new_hash()
+    if hash_index is not None:
+        digest = hash_index.lookup(path, stat, hasher.name)
+        if digest is not None:
+            return digest
+    digest = hash_file(path, hasher)
+    if hash_index is not None:
+        hash_index.store(path, stat, hasher.name, digest)
+    return digest
+
+def fetch_range(request, start, end, http=None, file_id=None):
+    """
+    Fetch bytes start..end (inclusive) of a media request with an HTTP Range header.
+    """
+    headers = {k: v for k, v in request.headers.items()
+               if k.lower() not in ('accept', 'accept-encoding', 'user-agent')}
+    headers['range'] = f'bytes={start}-{end}'
+
+    def get():
+        resp, content = (http or request.http).request(request.uri, 'GET', headers=headers)
+        if resp.status == 206 or (resp.status == 200 and start == 0):
+            return content
+        raise HttpError(resp, content, uri=request.uri)
+    return api_call(get, category='get_media', file_id=file_id)
+
+def sidecar_path(part_path: Path):
+    return part_path.with_name(part_path.name + '.json')
+
+def read_checkpoint(part_path: Path, item):
+    """
+    The checkpoint an earlier attempt left for part_path, or None when the sidecar
+    is missing, unreadable or describes a different revision of the file.
+    """
+    try:
+        with open(sidecar_path(part_path), encoding='utf-8') as f:
+            state = json.load(f)
+        if (state['id'] != item.id or state['size'] != item.size
+                or state['checksum'] != (item.checksum.hex() if item.checksum else None)):
+            return None
+        return state
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def resume_offset(part_path: Path, item):
+    """
+    Byte offset checkpointed for part_path by an earlier single-stream attempt, or 0.
+    """
+    state = read_checkpoint(part_path, item)
     try:
-        page_token = None
-        items = []
+        offset = state['offset']
+        return offset if 0 < offset <= part_path.stat().st_size else 0
+    except (OSError, KeyError, TypeError):
+        return 0
+
+def write_checkpoint(part_path: Path, item, **state):
+    """
+    Record progress on part_path: `offset` for a single stream, or `segments`
+    as [start, end, offset] ranges for a segmented download.
+    """
+    sidecar = sidecar_path(part_path)
+    tmp = sidecar.with_name(sidecar.name + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'id': item.id, 'size': item.size,
+                   'checksum': item.checksum.hex() if item.checksum else None, **state}, f)
+    os.replace(tmp, sidecar)
+
+def download_media(request, item, part_path: Path, hasher, progress):
+    """
+    Download a file's content into part_path with Range requests, resuming from a checkpoint when one exists.
+
+    After every chunk the .part file is flushed to disk and a small JSON sidecar
+    records the byte offset, so a crashed or killed run resumes where it left
+    off. Hash state objects cannot be serialized, so on resume the hash is
+    rebuilt by reading the local prefix back, which is far cheaper than
+    downloading it again.
+    """
+    offset = resume_offset(part_path, item)
+    if offset:
+        logging.info(f"Resuming {item.name} at byte {offset} of {item.size}.")
+        with open(part_path, 'r+b') as fh:
+            fh.truncate(offset)
+        if hasher is not None:
+            hash_file(part_path, hasher)
+        progress.skip(offset)
+
+    with open(part_path, 'r+b' if offset else 'wb') as fh:
+        fh.seek(offset)
+        while offset < item.size:
+            content = fetch_range(request, offset, min(offset + CHUNK_SIZE, item.size) - 1, file_id=item.id)
+            if not content:
+                raise IOError(f"Empty response at byte {offset} of {item.name}")
+            fh.write(content)
+            if hasher is not None:
+                hasher.update(content)
+            offset += len(content)
+
+            fh.flush()
+            os.fsync(fh.fileno())
+            write_checkpoint(part_path, item, offset=offset)
+            progress.update(len(content))
+
+    sidecar_path(part_path).unlink(missing_ok=True)
+
+def write_at(fh, data, offset):
+    """
+    Write data at offset without disturbing other writers; falls back to seek+write where pwrite is unavailable (Windows).
+    """
+    if hasattr(os, 'pwrite'):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fh.fileno(), view, offset)
+            view = view[written:]
+            offset += written
+    else:
+        fh.seek(offset)
+        fh.write(data)
+
+def download_segmented(service, request, item, part_path: Path, segments, progress):
+    """
+    Download a large file as `segments` byte ranges fetched in parallel.
+
+    The .part file is preallocated to the full size and every segment writes
+    its chunks in place, each on its own thread and HTTP transport. Segments
+    complete out of order, so the caller verifies the file with one hash pass
+    once all of them are done.
+
+    Like download_media, progress is checkpointed in the sidecar after every
+    chunk, here as one offset per segment, and a killed run resumes each range
+    where it stopped. A checkpoint left by a single-stream attempt resumes as
+    segments of its remaining tail.
+    """
+    state = read_checkpoint(part_path, item) or {}
+    try:
+        resumable = bool(state.get('segments')) and part_path.stat().st_size == item.size
+    except OSError:
+        resumable = False
+    if resumable:
+        ranges = [list(bounds) for bounds in state['segments']]
+    else:
+        start = resume_offset(part_path, item)
+        with open(part_path, 'r+b' if start else 'wb') as fh:
+            fh.truncate(item.size)
+        # Ceiling division; at least 1 so a checkpoint that got every byte down leaves no ranges, only the verify
+        step = max(1, -(-(item.size - start) // segments))
+        ranges = [[offset, min(offset + step, item.size) - 1, offset] for offset in range(start, item.size, step)]
+
+    remaining = sum(end + 1 - offset for _, end, offset in ranges)
+    if remaining < item.size:
+        logging.info(f"Resuming {item.name} with {remaining} of {item.size} bytes left.")
+        progress.skip(item.size - remaining)
+    checkpoint_lock = threading.Lock()
+
+    def fetch_segment(segment):
+        http = thread_http(service)
+        _, end, offset = segment
+        with open(part_path, 'r+b') as fh:
+            while offset <= end:
+                content = fetch_range(request, offset, min(offset + CHUNK_SIZE - 1, end), http, item.id)
+                if not content:
+                    raise IOError(f"Empty response at byte {offset} of {item.name}")
+                write_at(fh, content, offset)
+                offset += len(content)
+
+                fh.flush()  # only buffered on the seek+write fallback
+                os.fsync(fh.fileno())
+                with checkpoint_lock:
+                    segment[2] = offset
+                    write_checkpoint(part_path, item, segments=ranges)
+                progress.update(len(content))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(ranges))) as executor:
+        for future in [executor.submit(fetch_segment, segment) for segment in ranges]:
+            future.result()
+
+    sidecar_path(part_path).unlink(missing_ok=True)
+
+class Progress:
+    """
+    Progress bar for a pull whose total grows as the crawler discovers files.
+
+    Bytes are tracked per file through the Transfer returned by track(), so
+    a failed or retried attempt is taken back off the bar instead of being
+    counted twice. Google-native exports have no size up front: they are
+    counted as files, and their bytes are added to both sides of the bar as
+    they arrive. The rate and ETA come from a moving window of the last
+    `window` seconds, shown both overall and for each download worker.
+    """
+    BAR_FORMAT = '{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}{postfix}]'
+
+    def __init__(self, desc="Downloading files", window=30.0, status=None):
+        self.lock = threading.Lock()
+        self.window = window
+        self.status = status
+        self.files = self.files_done = 0
+        self.exports = self.exports_done = 0
+        self.moved = 0  # bytes actually transferred, for the rate
+        self.workers = defaultdict(int)
+        self.samples = deque([(time.monotonic(), 0, {})])
+        self.refreshed = 0.0
+        self.bar = tqdm(total=0, desc=desc, unit="B", unit_scale=True, bar_format=self.BAR_FORMAT)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.refresh(force=True)
+        self.bar.close()
+
+    def grow(self, item):
+        """
+        Add a file the crawler found to the totals.
+        """
+        with self.lock:
+            self.files += 1
+            if item.size is None:
+                self.exports += 1
+            else:
+                self.bar.total += item.size
+
+    def track(self, item):
+        return Transfer(self, item, threading.current_thread().name)
+
+    def add(self, count, worker=None, export=False):
+        with self.lock:
+            if export:
+                self.bar.total += count
+            self.bar.update(count)
+            if worker is not None and count > 0:
+                self.moved += count
+                self.workers[worker] += count
+        if worker is not None and count > 0:
+            metrics.inc('googlepull_downloaded_bytes_total', count)
+        self.refresh()
+
+    def finish(self, item):
+        with self.lock:
+            self.files_done += 1
+            if item.size is None:
+                self.exports_done += 1
+        self.refresh()
+
+    def rates(self):
+        """
+        Aggregate and per-worker bytes per second over the moving window.
+        """
+        now = time.monotonic()
+        if now - self.samples[-1][0] >= 1:
+            self.samples.append((now, self.moved, dict(self.workers)))
+        while len(self.samples) > 2 and now - self.samples[1][0] >= self.window:
+            self.samples.popleft()
+        start, moved, workers = self.samples[0]
+        elapsed = max(now - start, 1e-6)
+        return (self.moved - moved) / elapsed, {
+            worker: (count - workers.get(worker, 0)) / elapsed for worker, count in sorted(self.workers.items())}
+
+    def refresh(self, force=False):
+        with self.lock:
+            if not force and time.monotonic() - self.refreshed < self.bar.mininterval:
+                return
+            self.refreshed = time.monotonic()
+            rate, workers = self.rates()
+            remaining = self.bar.total - self.bar.n
+            fmt = tqdm.format_sizeof
+            postfix = [f"files={self.files_done}/{self.files}"]
+            if self.exports:
+                postfix.append(f"exports={self.exports_done}/{self.exports}")
+            postfix.append(f"{fmt(rate)}B/s")
+            if len(workers) > 1:
+                postfix.append("workers=" + " ".join(f"{fmt(worker_rate)}B/s" for worker_rate in workers.values()))
+            postfix.append(f"eta={tqdm.format_interval(remaining / rate) if rate else '?'}")
+            if self.status is not None:
+                postfix.extend(f"{key}={value}" for key, value in self.status().items())
+            self.bar.set_postfix_str(", ".join(postfix), refresh=False)
+            self.bar.refresh()
+
+class Transfer:
+    """
+    One file's share of a Progress, reported from whichever thread moves its bytes.
+    """
+    def __init__(self, progress, item, worker):
+        self.progress = progress
+        self.export = item.size is None
+        self.item = item
+        self.worker = worker
+        self.counted = 0
+        self.finished = False
+
+    def update(self, count):
+        """
+        Bytes just transferred; segment threads of one file call this concurrently.
+        """
+        with self.progress.lock:
+            self.counted += count
+        self.progress.add(count, self.worker, self.export)
+
+    def skip(self, count):
+        """
+        Bytes already on disk, e.g. from an interrupted run; they count as done but not toward the rate.
+        """
+        with self.progress.lock:
+            self.counted += count
+        self.progress.add(count)
+
+    def rollback(self):
+        """
+        Take this attempt's bytes back off the bar before a retry or on failure.
+        """
+        if self.finished:
+            return
+        with self.progress.lock:
+            counted, self.counted = self.counted, 0
+        self.progress.add(-counted, export=self.export)
+
+    def done(self):
+        if not self.export:
+            with self.progress.lock:
+                rest, self.counted = self.item.size - self.counted, self.item.size
+            self.progress.add(rest)
+        self.finished = True
+        self.progress.finish(self.item)
+
+class DeleteQueue:
+    """
+    Background pipeline stage that deletes verified items from Drive.
+
+    Download workers hand ids to add() and go straight back to transferring;
+    `workers` deleter threads drain the queue, each sending up to `batch_size`
+    ids (the API maximum is 100) per batch request after waiting at most
+    `linger` seconds for a batch to fill. Sub-requests that fail are retried
+    one at a time. on_deleted is called with each id once its Drive copy is
+    gone. `depth` is the number of ids waiting or in flight and `peak_depth`
+    its high-water mark, which shows whether deletes are falling behind.
+    """
+    def __init__(self, service, on_deleted=None, batch_size=100, workers=2, linger=0.5):
+        self.service = service
+        self.on_deleted = on_deleted
+        self.batch_size = min(batch_size, 100)
+        self.linger = linger
+        self.queue = queue.Queue()
+        self.peak_depth = 0
+        self.deleted_count = 0
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.run, name=f'deleter-{n}', daemon=True) for n in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    @property
+    def depth(self):
+        return self.queue.unfinished_tasks
+
+    def add(self, item_id):
+        self.queue.put(item_id)
+        with self.lock:
+            self.peak_depth = max(self.peak_depth, self.depth)
+
+    def flush(self):
+        """
+        Block until every id added so far has been deleted or given up on.
+        """
+        self.queue.join()
+
+    def close(self):
+        self.flush()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def run(self):
         while True:
-            results = service.files().list(
-                q=(f"'{parent_id}' in parents and trashed=false" if parent_id else "trashed=false"),
-                pageSize=100,
-                fields="nextPageToken, files(id, name, md5Checksum, size, mimeType)",
-                pageToken=page_token
-            ).execute()
-
-            new_items = results.get('files', [])
-            for item in new_items:
-                item['resourceKey'] = resource_key
-            items.extend(new_items)
-            logging.debug(f'Current items: {new_items}')
-
-            page_token = results.get('nextPageToken', None)
-            if page_token is None:
-                break
-    except HttpError as error:
-        logging.error(f"An error occurred: {error}")
-        return []
-
-    logging.debug('Finished listing sources.')
-    return items
-
-def get_total_files(service, parent_id):
-    items = list_sources(service, parent_id)
-    total_files = len(items)
-    for item in items:
-        if item['mimeType'] == 'application/vnd.google-apps.folder':
-            total_files += get_total_files(service, item['id'])
-    return total_files
-
-def get_total_size(service, parent_id):
-    items = list_sources(service, parent_id)
-    total_size = sum(int(item.get('size', 0)) for item in items if item['mimeType'] != 'application/vnd.google-apps.folder')
-    for item in items:
-        if item['mimeType'] == 'application/vnd.google-apps.folder':
-            total_size += get_total_size(service, item['id'])
-    return total_size
+            item_id = self.queue.get()
+            if item_id is None:
+                self.queue.task_done()
+                return
+
+            batch = [item_id]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_size:
+                try:
+                    item_id = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item_id is None:  # shutting down; leave the sentinel for this thread's next get
+                    self.queue.task_done()
+                    self.queue.put(None)
+                    break
+                batch.append(item_id)
+
+            try:
+                self.send(batch)
+            except Exception as e:
+                logging.error(f"An unexpected error occurred while deleting {len(batch)} items: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def deleted(self, file_id):
+        logging.debug("Item %s deleted from Google Drive.", file_id)
+        with self.lock:
+            self.deleted_count += 1
+        metrics.inc('googlepull_deleted_items_total')
+        if self.on_deleted is not None:
+            self.on_deleted(file_id)
+
+    def send(self, file_ids):
+        # A batch rejects two sub-requests with the same id, which would sink the whole batch
+        file_ids = list(dict.fromkeys(file_ids))
+        http = thread_http(self.service)
+        failed = []
+
+        def callback(request_id, response, exception):
+            # A 404 means an earlier, partially applied attempt already removed it
+            if exception is None or (isinstance(exception, HttpError) and exception.resp.status == 404):
+                self.deleted(request_id)
+            else:
+                if isinstance(exception, HttpError) and is_rate_limited(exception):
+                    metrics.inc('googlepull_rate_limited_total', op='delete')
+                    delay = retry_policy.delay(0, retry_after(exception))
+                    limiter.throttle(delay, retry_policy)
+                failed.append(request_id)
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for file_id in file_ids:
+            batch.add(self.service.files().delete(fileId=file_id), request_id=file_id)
+        try:
+            execute(batch, http, 'delete', cost=len(file_ids), file_id=file_ids)
+        except (HttpError,) + RetryPolicy.TRANSIENT_ERRORS as error:
+            logging.warning(f"Batch delete of {len(file_ids)} files failed, retrying individually: {error}")
+            failed = list(file_ids)
+
+        for file_id in failed:
+            self.delete_one(file_id, http)
+
+    def delete_one(self, file_id, http):
+        try:
+            execute(self.service.files().delete(fileId=file_id), http, 'delete', file_id=file_id)
+        except HttpError as error:
+            if error.resp.status != 404:
+                logging.error(f"Failed to delete {file_id}: {error}")
+                return
+        except RetryPolicy.TRANSIENT_ERRORS as error:
+            logging.error(f"Failed to delete {file_id}: {error}")
+            return
+        self.deleted(file_id)
 
 def get_destination(attempts=3):
     """
@@ -123,132 +1668,361 @@ def get_destination(attempts=3):
             logging.error("Invalid path, please try again.")
     raise ValueError("Maximum number of attempts reached. Please check your destination path.")
 
-def download_file(service, item, dest_folder: Path, pbar, max_retry=5):
-    print('Processing file:', item['name'])  # debug print
-    logging.debug(f"Processing file: {item['name']} ({item['id']})")
+# Extension given to Google-native files, which are saved in their Office export format
+EXPORT_SUFFIXES = {
+    'application/vnd.google-apps.document': '.docx',
+    'application/vnd.google-apps.spreadsheet': '.xlsx',
+    'application/vnd.google-apps.presentation': '.pptx',
+}
+
+def local_name(item):
+    """
+    The file name an item is saved under locally.
+    """
+    suffix = EXPORT_SUFFIXES.get(item.mime_type)
+    return Path(item.name).with_suffix(suffix).name if suffix else item.name
+
+def local_names(manifest, folder, names=None):
+    """
+    Map the position of every file directly in folder to its local file name.
+
+    Drive allows several items with the same name in one folder. The first
+    sibling listed keeps its name; every later one whose name collides with
+    it (case-insensitively, as on Windows and macOS) gets its id appended, so
+    no two transfers share a destination. Names are assigned over all the
+    siblings in the manifest, in listing order, so a pass over only some of
+    them names them as the full pass did. Pass the map from an earlier call
+    as `names` to extend it with siblings listed since; names already handed
+    out never change.
+    """
+    names = {} if names is None else names
+    taken = {name.casefold() for name in names.values()}
+    for child in manifest.children[folder]:
+        record = manifest.records[child]
+        if record.is_folder or child in names:
+            continue
+        name = local_name(record)
+        if name.casefold() in taken:
+            path = Path(name)
+            name = f"{path.stem} ({record.id}){path.suffix}"
+        taken.add(name.casefold())
+        names[child] = name
+    return names
 
+def download_file(service, item, dest_folder: Path, progress, hash_index=None,
+                  segments=1, segment_threshold=None, on_verified=None, on_downloaded=None, name=None):
+    """
+    Download a single item and delete it from Drive. Returns True once the Drive copy is deleted,
+    or once on_verified has been called with its id when given, leaving the delete to the caller.
+    on_downloaded, when given, is called with the id as soon as the bytes are on disk. The file is
+    saved as `name` in dest_folder, by default its local_name().
+    """
+    logging.debug("Processing file: %s (%s)", item.name, item.id)
+    http = thread_http(service)
+    transfer = progress.track(item)
+
+    max_retry = retry_policy.max_attempts
     for attempt in range(max_retry):
         try:
-            dest_file_path = dest_folder / item['name']
+            dest_file_path = dest_folder / (name or local_name(item))
             dest_folder.mkdir(parents=True, exist_ok=True)
 
-            if dest_file_path.exists():
-                with open(dest_file_path, 'rb') as f_in:
-                    m = hashlib.md5()
-                    m.update(f_in.read())
-                    computed_md5 = m.hexdigest()
-
-                if computed_md5 == item.get('md5Checksum', None):
-                    logging.debug(f"File {item['name']} already exists and matches source. Deleting from Drive.")
-                    # Delete the file from Google Drive
-                    service.files().delete(fileId=item['id']).execute()
-                    logging.debug(f"File {item['name']} deleted from Google Drive.")
-                    return
+            if item.checksum and local_digest(dest_file_path, item, hash_index) == item.checksum:
+                logging.debug("File %s already exists and matches source. Deleting from Drive.", item.name)
+                transfer.done()
+                metrics.inc('googlepull_files_total', result='existing')
+                # Delete the file from Google Drive
+                if on_verified is not None:
+                    on_verified(item.id)
+                    return True
+                execute(service.files().delete(fileId=item.id), http, 'delete', file_id=item.id)
+                logging.debug("File %s deleted from Google Drive.", item.name)
+                return True
 
             logging.debug("Downloading file...")
             request = None
-            mimeType = item['mimeType']
+            mimeType = item.mime_type
             if mimeType == 'application/vnd.google-apps.document':
-                request = service.files().export_media(fileId=item['id'], mimeType='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-                dest_file_path = dest_file_path.with_suffix('.docx')
+                request = service.files().export_media(fileId=item.id, mimeType='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
             elif mimeType == 'application/vnd.google-apps.spreadsheet':
-                request = service.files().export_media(fileId=item['id'], mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-                dest_file_path = dest_file_path.with_suffix('.xlsx')
+                request = service.files().export_media(fileId=item.id, mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
             elif mimeType == 'application/vnd.google-apps.presentation':
-                request = service.files().export_media(fileId=item['id'], mimeType='application/vnd.openxmlformats-officedocument.presentationml.presentation')
-                dest_file_path = dest_file_path.with_suffix('.pptx')
+                request = service.files().export_media(fileId=item.id, mimeType='application/vnd.openxmlformats-officedocument.presentationml.presentation')
             else:
-                request = service.files().get_media(fileId=item['id'])
+                request = service.files().get_media(fileId=item.id)
 
             # Check if the item has a resource key
-            if 'resourceKey' in item:
+            if item.resource_key:
                 # Set the resource key for accessing link-shared files
-                request.headers['X-Goog-Drive-Resource-Keys'] = f"{item['id']}/{item['resourceKey']}"
-
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-                pbar.update(int(status.resumable_progress))
-
-            logging.debug("Download complete. Writing to file...")
-            with open(dest_file_path, 'wb') as f_out:
-                f_out.write(fh.getvalue())
+                request.headers['X-Goog-Drive-Resource-Keys'] = f"{item.id}/{item.resource_key}"
+
+            # Stream chunks into a .part file next to the destination, then move it into place
+            request.http = http
+            # Named per item, so two items can never write the same temp file
+            part_path = dest_file_path.with_name(f"{dest_file_path.name}.{item.id}.part")
+            hasher = item.new_hash()
+            if item.size is not None and segments > 1 and segment_threshold and item.size >= segment_threshold:
+                download_segmented(service, request, item, part_path, segments, transfer)
+                if hasher is not None:
+                    hash_file(part_path, hasher)
+            elif item.size is not None:
+                download_media(request, item, part_path, hasher, transfer)
+            else:
+                # Exports have no size to range over, so they always start from scratch
+                with open(part_path, 'wb') as fh:
+                    downloader = MediaIoBaseDownload(HashingWriter(fh, hasher), request, chunksize=CHUNK_SIZE)
+                    done = False
+                    while done is False:
+                        status, done = api_call(downloader.next_chunk, category='export_media', file_id=item.id)
+                        # resumable_progress is cumulative, so only the new bytes go to the bar
+                        transfer.update(status.resumable_progress - transfer.counted)
+
+            if on_downloaded is not None:
+                on_downloaded(item.id)
+
+            # Verify against Drive's checksum before anything destructive happens
+            if hasher is not None and hasher.digest() != item.checksum:
+                part_path.unlink()
+                raise ChecksumMismatch(f"{hasher.name} {hasher.hexdigest()} != {item.checksum.hex()}")
+
+            logging.debug("Download verified. Moving into place...")
+            os.replace(part_path, dest_file_path)
+            if hasher is not None and hash_index is not None:
+                hash_index.store(dest_file_path, dest_file_path.stat(), hasher.name, hasher.digest())
             logging.debug("File written.")
+            transfer.done()
+            metrics.inc('googlepull_files_total', result='downloaded')
 
             # Delete the file from Google Drive
-            service.files().delete(fileId=item['id']).execute()
-            logging.debug(f"File {item['name']} deleted from Google Drive.")
+            if on_verified is not None:
+                on_verified(item.id)
+                return True
+            execute(service.files().delete(fileId=item.id), http, 'delete', file_id=item.id)
+            logging.debug("File %s deleted from Google Drive.", item.name)
 
-            # If file download and deletion is successful, break the retry loop
-            break
+            # If file download and deletion is successful, stop retrying
+            return True
 
         except HttpError as error:
-            if error.resp.status in [403, 429, 500, 503]:
-                sleep_time = 2**attempt  # exponential backoff
-                logging.warning(f"Rate limit exceeded, retrying in {sleep_time} seconds...")
-                time.sleep(sleep_time)
-            else:
-                logging.error(f"An error occurred while downloading the file {item['name']}: {error}")
-                break
+            # Transient errors were already retried by api_call under retry_policy
+            logging.error(f"An error occurred while downloading the file {item.name}: {error}")
+            break
+        except ChecksumMismatch as e:
+            logging.warning(f"Checksum mismatch for {item.name}, retrying download: {e}")
+            transfer.rollback()
         except Exception as e:
-            logging.error(f"An unexpected error occurred while downloading the file {item['name']}: {e}")
+            logging.error(f"An unexpected error occurred while downloading the file {item.name}: {e}")
             break
 
+    if not transfer.finished:
+        transfer.rollback()
+        metrics.inc('googlepull_files_total', result='failed')
     if attempt == max_retry - 1:
-        logging.error(f"Failed to download the file {item['name']} after {max_retry} attempts.")
+        logging.error(f"Failed to download the file {item.name} after {max_retry} attempts.")
+    return False
 
 
-def download_files(service, source, dest_folder, is_root=False):
+def download_files(service, manifest, dest_folder, workers=1, segments=1, segment_threshold=None,
+                   delete_batch_size=100, delete_subtrees=True, delete_workers=2, listing_max_age=3600,
+                   journal=None, positions=None, crawl=None):
     """
-    Download all files from a source to the destination folder.
+    Download all files in the manifest to the destination folder, or only the
+    files at `positions` when given. Returns the manifest.
+
+    Up to `workers` files are transferred at once, each worker thread on its own
+    HTTP transport, with progress aggregated into a single bar. Files of at
+    least `segment_threshold` bytes are split into `segments` parallel ranges.
+    Verified items are deleted from Drive in batches of `delete_batch_size`;
+    with `delete_subtrees`, file deletes are held back so a fully verified
+    folder goes with a single delete of the folder itself; when the listing
+    is more than `listing_max_age` seconds old, such folders are listed again
+    first. Deletes run on `delete_workers` background threads so downloads
+    never wait on them.
+    Every state change is recorded in `journal` when one is given, and files
+    it already shows as verified are not transferred again.
+
+    When `crawl` is given it is called with a listing callback and must return
+    the manifest it builds (`manifest` may then be None). Files are queued as
+    soon as their folder is listed, so transfers start while the crawl is still
+    running and the progress total grows with it.
     """
-    if not is_root:  # only create subdirectories if not root
-        dest_folder = dest_folder / source['name']
     dest_folder.mkdir(parents=True, exist_ok=True)
+    hash_index = HashIndex(dest_folder)
+
+    def record(item_id, state):
+        if journal is not None:
+            journal.record(manifest.index[item_id], state)
+
+    def mark_deleted(item_id):
+        manifest.mark_deleted(manifest.index[item_id])
+        record(item_id, DELETED)
+    delete_queue = DeleteQueue(service, mark_deleted, delete_batch_size, workers=delete_workers)
+
+    def mark_downloaded(file_id):
+        record(file_id, DOWNLOADED)
 
-    items = list_sources(service, source['id'])
-    logging.debug(f"Items to download: {items}")  # <-- Add this debug line
+    verified_now = set()
 
-    with tqdm(total=get_total_size(service, source['id']), desc="Downloading files", unit="B", unit_scale=True) as pbar:
-        # ...
-        # Single-threaded download
-        for item in items:
-            if item['mimeType'] != 'application/vnd.google-apps.folder':
-                download_file(service, item, dest_folder, pbar)
+    def mark_verified(file_id):
+        manifest.verified[manifest.index[file_id]] = 1
+        verified_now.add(file_id)
+        record(file_id, VERIFIED)
+        if not delete_subtrees:
+            delete_queue.add(file_id)
 
-        for item in items:
-            if item['mimeType'] == 'application/vnd.google-apps.folder':
-                download_files(service, {'id': item['id'], 'name': item['name']}, dest_folder)
+    def run_download(*args, **kwargs):
+        metrics.inc('googlepull_queue_depth', -1, queue='download')
+        metrics.inc('googlepull_download_workers_active')
+        try:
+            return download_file(*args, **kwargs)
+        finally:
+            metrics.inc('googlepull_download_workers_active', -1)
+
+    metrics.set('googlepull_queue_depth', lambda: delete_queue.depth, queue='delete')
+    metrics.set('googlepull_queue_depth', 0, queue='download')
+
+    with Progress(status=lambda: {'delete_queue': delete_queue.depth}) as progress:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='download') as executor:
+            futures = {}
+            folder_paths = {}
+            folder_names = {}
+
+            def submit(listed, children):
+                nonlocal manifest
+                manifest = listed
+                for child in children:
+                    item = manifest.records[child]
+                    folder_path = folder_paths.get(item.parent)
+                    if folder_path is None:
+                        folder_path = folder_paths[item.parent] = manifest.dest_path(item.parent, dest_folder)
+                        folder_path.mkdir(parents=True, exist_ok=True)
+                    if item.is_folder:
+                        if positions is None:
+                            # A full pass recreates the whole folder structure, empty folders included
+                            manifest.dest_path(child, dest_folder).mkdir(parents=True, exist_ok=True)
+                        continue
+                    if child not in folder_names.get(item.parent, ()):
+                        # Every sibling listed so far is named, including finished ones, which keep their claim
+                        folder_names[item.parent] = local_names(manifest, item.parent, folder_names.get(item.parent))
+                    if manifest.deleted[child] or manifest.verified[child]:
+                        continue
+                    progress.grow(item)
+                    metrics.inc('googlepull_queue_depth', queue='download')
+                    futures[executor.submit(run_download, service, item, folder_path, progress,
+                                            hash_index=hash_index, segments=segments,
+                                            segment_threshold=segment_threshold,
+                                            on_verified=mark_verified,
+                                            on_downloaded=mark_downloaded,
+                                            name=folder_names[item.parent][child])] = child
+
+            if crawl is not None:
+                manifest = crawl(submit)
+            elif positions is not None:
+                submit(manifest, positions)
+            else:
+                for folder in manifest.folders():
+                    submit(manifest, manifest.children[folder])
+            logging.debug("Items to download: %d", len(futures))
 
-    # Delete empty folders after all files have been downloaded
-    delete_empty_folders(service, source['id'])
+            for _ in concurrent.futures.as_completed(futures):
+                progress.refresh()
+            if not delete_subtrees:
+                # Files verified earlier (an interrupted run, a failed delete) but still in Drive;
+                # those verified in this pass were queued by mark_verified already
+                for child in manifest.files() if positions is None else positions:
+                    item_id = manifest.records[child].id
+                    if manifest.verified[child] and not manifest.deleted[child] and item_id not in verified_now:
+                        delete_queue.add(item_id)
+        delete_queue.flush()
+    hash_index.close()
 
-def delete_empty_folders(service, folder_id, max_retry=5):
+    # Delete fully verified folders (and any verified files outside them) after all files have been downloaded
+    delete_verified_subtrees(service, manifest, delete_queue, listing_max_age, journal=journal,
+                             delete_subtrees=delete_subtrees)
+    delete_queue.close()
+    logging.info(f"Deleted {delete_queue.deleted_count} items from Google Drive; "
+                 f"peak delete queue depth {delete_queue.peak_depth}.")
+    logging.info(f"API queries so far by category: {dict(quota.totals)}; last minute: {quota.per_minute()}")
+    return manifest
+
+def delete_verified_subtrees(service, manifest, delete_queue, listing_max_age=None, batch_size=25, journal=None,
+                             delete_subtrees=True):
     """
-    Deletes the empty folders in Google Drive.
+    Delete the highest folders in Google Drive whose every descendant is verified locally.
+
+    Deleting a Drive folder removes its whole contents, so one call replaces a
+    delete per file plus a re-crawl to find empty folders. That is only safe
+    while the listing is current: once it is older than `listing_max_age`
+    seconds (a run resumed from the journal, or a very long one) the folders
+    about to be deleted are listed again, and any that gained items since no
+    longer qualify. The new items are added to the manifest for a later pass.
+
+    Without `delete_subtrees` no folder is deleted with its contents: files go
+    one by one and folders only through delete_empty_folders().
+    """
+    roots = manifest.deletion_roots()
+    if not delete_subtrees:
+        for position in roots:
+            if not manifest.records[position].is_folder:
+                delete_queue.add(manifest.records[position].id)
+        delete_queue.flush()
+        delete_empty_folders(service, manifest,
+                             [folder for root in roots if manifest.records[root].is_folder
+                              for folder in manifest.folders(root)],
+                             delete_queue)
+        return
+    if listing_max_age is not None and time.time() - manifest.crawled_at > listing_max_age:
+        folders = [folder for root in roots if manifest.records[root].is_folder for folder in manifest.folders(root)]
+        if folders:
+            logging.info(f"Listing is {(time.time() - manifest.crawled_at) / 60:.0f} minutes old, "
+                         f"re-listing {len(folders)} folders before deleting them...")
+            start = len(manifest.records)
+            relist_folders(service, manifest, folders, batch_size)
+            if journal is not None:
+                journal.extend(manifest, start)
+            roots = manifest.deletion_roots()
+    for position in roots:
+        delete_queue.add(manifest.records[position].id)
+    delete_queue.flush()
+
+def delete_empty_folders(service, manifest, folders, delete_queue):
     """
-    items = list_sources(service, folder_id)
-    if not items:  # the folder is empty
-        for _ in range(max_retry):
+    Delete those of the given folders that a fresh listing shows are empty.
+
+    Folders are handled deepest level first, each level's deletes finishing
+    before the level above is listed, so a folder emptied of its subfolders
+    goes too. Anything added to a folder since the crawl shows up in its
+    listing and keeps the folder, and whatever is in it, in Drive.
+    """
+    http = thread_http(service)
+    depth = {}
+    for folder in folders:  # parents come before their subfolders
+        depth[folder] = depth.get(manifest.records[folder].parent, -1) + 1
+    for level in sorted(set(depth.values()), reverse=True):
+        for folder in (folder for folder in folders if depth[folder] == level):
+            record = manifest.records[folder]
             try:
-                service.files().delete(fileId=folder_id).execute()
-                logging.debug(f"Folder {folder_id} deleted from Google Drive.")
-                break
-            except HttpError as error:
-                if error.resp.status in [403, 429, 500, 503]:
-                    sleep_time = 2**_  # exponential backoff
-                    logging.warning(f"Rate limit exceeded, retrying in {sleep_time} seconds...")
-                    time.sleep(sleep_time)
-                else:
-                    raise
-        else:
-            logging.error("Exceeded maximum retry attempts.")
-    else:
-        for item in items:
-            if item['mimeType'] == 'application/vnd.google-apps.folder':
-                delete_empty_folders(service, item['id'])
+                empty = next(iter_sources(service, record.id, record.resource_key, http), None) is None
+            except (HttpError,) + RetryPolicy.TRANSIENT_ERRORS as error:
+                logging.error(f"Failed to list folder {record.id}, not deleting it: {error}")
+                continue
+            if empty:
+                delete_queue.add(record.id)
+        delete_queue.flush()
+
+def download_settings(config):
+    """
+    Keyword arguments for download_files taken from the config.
+    """
+    return {
+        'workers': config.getint('download_workers', 4),
+        'segments': config.getint('segments', 4),
+        'segment_threshold': config.getint('segment_threshold_mb', 256) * 1024 * 1024,
+        'delete_batch_size': config.getint('delete_batch_size', 100),
+        'delete_subtrees': config.getboolean('delete_subtrees', True),
+        'delete_workers': config.getint('delete_workers', 2),
+        'listing_max_age': config.getint('listing_max_age_minutes', 60) * 60,
+    }
 
 def generate_token(config):
     SCOPES = ['https://www.googleapis.com/auth/drive']
@@ -259,26 +2033,88 @@ def generate_token(config):
     with open(config.get('token_file', 'token.pickle'), 'wb') as token_file:
         pickle.dump(creds, token_file)
 
-def recheck_source(service, source, dest_folder, max_retry=5):
-    """Recheck the source for remaining files and download them if any."""
+def recheck_source(service, manifest, dest_folder, config, max_retry=5, journal=None):
+    """
+    Retry whatever is still outstanding after the first pass. Returns the manifest.
 
-    retry = 0
-    while retry < max_retry:
-        items = list_sources(service, source['id'])
-        if not items:  # no items remaining
+    Only the residue is touched: files not yet verified and deleted, and
+    folders whose listing failed. Each of those backs off on its own schedule
+    and is given up on after `max_retry` more rounds, so a handful of
+    failures costs a handful of calls instead of a re-crawl and re-hash of
+    the whole tree.
+    """
+    settings = download_settings(config)
+    batch_size = config.getint('crawl_batch_size', 25)
+    attempts = {}
+    due = {}
+
+    def schedule(position, now):
+        attempts[position] = attempts.get(position, 0) + 1
+        due[position] = now + retry_policy.delay(attempts[position])
+
+    while True:
+        now = time.monotonic()
+        outstanding = manifest.remaining() + list(manifest.incomplete)
+        for position in outstanding:
+            if position not in attempts:
+                schedule(position, now)
+        outstanding = [position for position in outstanding if attempts[position] <= max_retry]
+        if not outstanding:
             break
 
-        logging.info(f"Retrying download operation, attempt {retry+1}...")
-        download_files(service, source, dest_folder, is_root=True)
-        retry += 1
+        ready = [position for position in outstanding if due[position] <= now]
+        if not ready:
+            wait = min(due[position] for position in outstanding) - now
+            if not retry_policy.spend(wait):
+                logging.error("Retry budget used up, not retrying the remaining items.")
+                break
+            time.sleep(wait)
+            continue
+
+        folders = [position for position in ready if manifest.records[position].is_folder]
+        files = [position for position in ready if not manifest.records[position].is_folder]
+        if folders:
+            start = len(manifest.records)
+            relist_folders(service, manifest, folders, batch_size)
+            found = [position for position in range(start, len(manifest.records))
+                     if not manifest.records[position].is_folder]
+            for position in found:
+                attempts[position] = 1  # first try, not a retry
+            files += found
+            if journal is not None:
+                journal.extend(manifest, start)
+
+        logging.info(f"Retrying {len(files)} files and {len(folders)} folder listings...")
+        download_files(service, manifest, dest_folder, journal=journal, positions=files, **settings)
 
-    if retry == max_retry:
-        logging.error("Max retry attempts reached, still files remain in the source.")
+        now = time.monotonic()
+        for position in files:
+            if not manifest.deleted[position]:
+                schedule(position, now)
+        for position in folders:
+            if position in manifest.incomplete:
+                schedule(position, now)
+
+    left = len(manifest.remaining()) + len(manifest.incomplete)
+    if left:
+        logging.error(f"{left} items still remain in the source after retrying.")
+    return manifest
 
 def main():
     try:
         config = read_config()
         setup_logging(config)
+        limiter.configure(max_concurrency=config.getint('api_concurrency', 16))
+        quota.configure(qpm=config.getint('queries_per_minute', 0))
+        retry_policy.configure(max_attempts=config.getint('max_retry', 10),
+                               max_sleep=config.getfloat('max_retry_sleep', 60),
+                               budget=config.getfloat('retry_budget', 1800))
+        if config.getint('metrics_port', 0):
+            metrics.serve(config.getint('metrics_port'), config.get('metrics_address', '127.0.0.1'))
+        if config.get('metrics_file', ''):
+            metrics.write_every(config.get('metrics_file'), config.getfloat('metrics_interval', 15))
+        if config.get('trace_file', ''):
+            tracer.open(config.get('trace_file'), config.get('trace_format', 'jsonl'))
 
         token_file = Path(config.get('token_file', 'token.pickle'))
         if not token_file.exists():
@@ -298,16 +2134,18 @@ def main():
         folder_id = url_parts.path.split('/')[-1]
         resource_key = query.get('resourcekey', [None])[0]
 
-        logging.debug(f'Getting files from the folder with ID {folder_id}...')
-        all_sources = list_sources(service, folder_id, resource_key)
-        logging.debug('Got all files.')
-    
-        if not all_sources:
+        # One listing call is enough to tell an empty (or inaccessible) source apart before any prompt
+        if next(iter_sources(service, folder_id, resource_key), None) is None:
             logging.info("No sources available.")
             return
 
-        source = {'id': folder_id, 'name': 'Folder to Download'}
         dest_folder = get_destination()
+        journal = Journal(dest_folder)
+
+        # Resume an interrupted run from its journal rather than crawling Drive again
+        manifest = journal.load(folder_id)
+        if manifest is not None and not manifest.remaining():
+            manifest = None
 
         warning_message = "\nWARNING: This operation will DELETE files from Google Drive once they are downloaded. "
         warning_message += "This is a DESTRUCTIVE action. To proceed, type 'Yes' or 'Y': "
@@ -318,15 +2156,36 @@ def main():
 
         if confirmation not in ["yes", "y"]:
             logging.info("Operation cancelled by the user.")
+            journal.close()
             return
 
-        logging.info(f"Downloading files from {source['name']} to {dest_folder}...")
-        download_files(service, source, dest_folder, is_root=True)
-        recheck_source(service, source, dest_folder)  # call the recheck_source function after the initial download
+        def crawl(on_listed):
+            logging.debug('Getting files from the folder with ID %s...', folder_id)
+            journal.start(folder_id, 'Folder to Download', resource_key)
+            crawled = crawl_manifest(service, folder_id, 'Folder to Download', resource_key, config, on_listed)
+            journal.save_manifest(crawled)
+            logging.debug('Got all files.')
+            return crawled
+
+        # Downloads start as soon as the first folders are listed
+        logging.info(f"Downloading files from {folder_id} to {dest_folder}...")
+        manifest = download_files(service, manifest, dest_folder, journal=journal,
+                                  crawl=crawl if manifest is None else None, **download_settings(config))
+        if not manifest.children[0]:
+            logging.info("No sources available.")
+            journal.close()
+            return
+        manifest = recheck_source(service, manifest, dest_folder, config, journal=journal)  # call the recheck_source function after the initial download
+        if not manifest.remaining():
+            journal.finish()
+        journal.close()
         logging.info("Operation completed.")
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         logging.error(traceback.format_exc())
+    finally:
+        metrics.close()
+        tracer.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
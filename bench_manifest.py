@@ -0,0 +1,67 @@
+"""
+Measure manifest memory per item: raw listing dicts versus DriveItem records.
+
+Usage: python bench_manifest.py [item_count]
+"""
+import json
+import sys
+import tracemalloc
+from GooglePull import Manifest, FOLDER_MIME_TYPE
+
+FOLDER_FANOUT = 50  # files per folder in the synthetic tree
+
+def listing_pages(count):
+    """
+    Yield (parent_id, items) pages parsed from JSON, the way files.list results arrive.
+    """
+    parent_id = 'root'
+    folder = 0
+    for start in range(0, count, 1000):
+        page = []
+        for n in range(start, min(start + 1000, count)):
+            if n % FOLDER_FANOUT == 0:
+                folder += 1
+                page.append({'id': f'1Fo{folder:030d}', 'name': f'Folder {folder}', 'mimeType': FOLDER_MIME_TYPE,
+                             'parents': [parent_id]})
+                continue
+            page.append({'id': f'1Fi{n:030d}', 'name': f'IMG_{n:08d}.jpg', 'mimeType': 'image/jpeg',
+                         'size': str(1000000 + n), 'md5Checksum': f'{n:032x}', 'sha256Checksum': f'{n:064x}',
+                         'parents': [f'1Fo{folder:030d}']})
+        yield json.loads(json.dumps(page))
+
+def measure(build, count):
+    tracemalloc.start()
+    result = build(count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current / count
+
+def build_dicts(count):
+    """
+    The pre-DriveItem layout: every listing dict kept, keyed by id, plus parent and child maps.
+    """
+    items, parents, children = {}, {}, {'root': []}
+    for page in listing_pages(count):
+        for item in page:
+            parent_id = item['parents'][0]
+            item['resourceKey'] = None
+            items[item['id']] = item
+            parents[item['id']] = parent_id
+            children.setdefault(parent_id, []).append(item['id'])
+    return items, parents, children
+
+def build_records(count):
+    manifest = Manifest('root', 'root')
+    for page in listing_pages(count):
+        for item in page:
+            manifest.add(item['parents'][0], item)
+    return manifest
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    dicts = measure(build_dicts, count)
+    records = measure(build_records, count)
+    print(f"{count} items")
+    print(f"listing dicts:     {dicts:7.0f} bytes/item")
+    print(f"DriveItem records: {records:7.0f} bytes/item ({dicts / records:.1f}x smaller)")
\ No newline at end of file
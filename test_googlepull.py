@@ -0,0 +1,452 @@
+"""
+Tests for the paths that decide what may be deleted from Drive: verified-item
+bookkeeping, local naming, resumable transfers, the journal and the retry pass.
+
+Usage: python -m pytest test_googlepull.py
+"""
+import configparser
+import hashlib
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from googleapiclient.errors import HttpError
+
+import GooglePull
+from GooglePull import (DELETED, VERIFIED, DeleteQueue, DriveItem, Journal, Manifest, RetryPolicy,
+                        delete_empty_folders, download_files, download_media, download_segmented, local_names,
+                        mime_code, read_checkpoint, recheck_source, sidecar_path, write_checkpoint)
+
+FILE_MIME = mime_code('application/octet-stream')
+
+def build_tree(tree, manifest=None, parent=0):
+    """
+    Add a nested {name: subtree or None} dict to a manifest; None marks a file.
+    Returns the manifest and a {name: position} map (names must be unique).
+    """
+    manifest = manifest or Manifest('root', 'root')
+    positions = {}
+    for name, subtree in tree.items():
+        mime = 0 if isinstance(subtree, dict) else FILE_MIME
+        position = positions[name] = manifest.append(DriveItem(f'id-{name}', parent, name, mime=mime))
+        if subtree is not None:
+            positions.update(build_tree(subtree, manifest, position)[1])
+    return manifest, positions
+
+class DeletionRootsTest(unittest.TestCase):
+    def verify(self, manifest, positions, *names):
+        for name in names:
+            manifest.verified[positions[name]] = 1
+
+    def test_empty_root_is_never_deleted(self):
+        manifest = Manifest('root', 'root')
+        self.assertEqual(manifest.deletion_roots(), [])
+
+    def test_fully_verified_tree_is_deleted_from_the_root(self):
+        manifest, positions = build_tree({'a': None, 'sub': {'b': None, 'empty': {}}})
+        self.verify(manifest, positions, 'a', 'b')
+        self.assertEqual(manifest.deletion_roots(), [0])
+
+    def test_nothing_verified_deletes_nothing(self):
+        manifest, _ = build_tree({'a': None, 'sub': {'b': None}})
+        self.assertEqual(manifest.deletion_roots(), [])
+
+    def test_mixed_children_keep_their_folder(self):
+        manifest, positions = build_tree({'mixed': {'done': None, 'pending': None}, 'full': {'c': None}})
+        self.verify(manifest, positions, 'done', 'c')
+        self.assertEqual(sorted(manifest.deletion_roots()), sorted([positions['full'], positions['done']]))
+
+    def test_incomplete_folder_is_never_deleted_as_a_whole(self):
+        manifest, positions = build_tree({'partial': {'a': None}, 'b': None})
+        self.verify(manifest, positions, 'a', 'b')
+        manifest.incomplete.add(positions['partial'])
+        self.assertEqual(sorted(manifest.deletion_roots()), sorted([positions['a'], positions['b']]))
+
+    def test_incomplete_listing_of_an_empty_looking_folder(self):
+        manifest, positions = build_tree({'unlisted': {}, 'a': None})
+        self.verify(manifest, positions, 'a')
+        manifest.incomplete.add(positions['unlisted'])
+        self.assertEqual(manifest.deletion_roots(), [positions['a']])
+
+    def test_mark_deleted_propagates_to_descendants(self):
+        manifest, positions = build_tree({'sub': {'a': None, 'deep': {'b': None}}, 'c': None})
+        manifest.mark_deleted(positions['sub'])
+        for name in ('sub', 'a', 'deep', 'b'):
+            self.assertTrue(manifest.deleted[positions[name]], name)
+        self.assertFalse(manifest.deleted[positions['c']])
+        self.assertFalse(manifest.deleted[0])
+
+    def test_deleted_items_count_as_done_but_are_not_deleted_again(self):
+        manifest, positions = build_tree({'gone': {'a': None}, 'mixed': {'b': None, 'c': None}, 'd': None})
+        manifest.mark_deleted(positions['gone'])
+        manifest.mark_deleted(positions['b'])
+        self.verify(manifest, positions, 'c')
+        self.assertEqual(manifest.deletion_roots(), [positions['mixed']])
+        self.verify(manifest, positions, 'd')
+        self.assertEqual(manifest.deletion_roots(), [0])
+        manifest.mark_deleted(0)
+        self.assertEqual(manifest.deletion_roots(), [])
+
+class FakeResponse(dict):
+    def __init__(self, status):
+        super().__init__(status=str(status))
+        self.status = status
+        self.reason = ''
+
+class FakeDrive:
+    """
+    Just enough of a Drive service for DeleteQueue: files().delete() and batches.
+    """
+    def __init__(self, ids, fail_in_batch=(), fail_always=()):
+        self.alive = set(ids)
+        self.fail_in_batch = set(fail_in_batch)
+        self.fail_always = set(fail_always)
+        self.batches = []
+        self.single = []
+
+    def files(self):
+        return self
+
+    def delete(self, fileId):
+        return FakeRequest(self, fileId)
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def remove(self, file_id, in_batch):
+        if file_id in self.fail_always or (in_batch and file_id in self.fail_in_batch):
+            raise HttpError(FakeResponse(403), b'forbidden')
+        if file_id not in self.alive:
+            raise HttpError(FakeResponse(404), b'not found')
+        self.alive.discard(file_id)
+
+class FakeRequest:
+    def __init__(self, drive, file_id):
+        self.drive = drive
+        self.file_id = file_id
+
+    def execute(self, http=None):
+        self.drive.single.append(self.file_id)
+        self.drive.remove(self.file_id, in_batch=False)
+
+class FakeBatch:
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = {}
+
+    def add(self, request, request_id):
+        if request_id in self.requests:
+            raise KeyError(f'A request with this ID already exists: {request_id}')
+        self.requests[request_id] = request
+
+    def execute(self, http=None):
+        self.drive.batches.append(list(self.requests))
+        for request_id, request in self.requests.items():
+            try:
+                self.drive.remove(request.file_id, in_batch=True)
+            except HttpError as error:
+                self.callback(request_id, None, error)
+            else:
+                self.callback(request_id, '', None)
+
+@mock.patch.object(GooglePull, 'thread_http', lambda service: None)
+class DeleteQueueTest(unittest.TestCase):
+    def run_queue(self, drive, ids, batch_size=100):
+        deleted = []
+        delete_queue = DeleteQueue(drive, deleted.append, batch_size, workers=1, linger=0.05)
+        for item_id in ids:
+            delete_queue.add(item_id)
+        delete_queue.close()
+        return delete_queue, deleted
+
+    def test_deletes_in_batches(self):
+        ids = [f'id{n}' for n in range(5)]
+        drive = FakeDrive(ids)
+        delete_queue, deleted = self.run_queue(drive, ids, batch_size=2)
+        self.assertEqual(sorted(deleted), ids)
+        self.assertEqual(drive.alive, set())
+        self.assertTrue(all(len(batch) <= 2 for batch in drive.batches))
+        self.assertEqual(delete_queue.deleted_count, 5)
+        self.assertEqual(delete_queue.depth, 0)
+
+    def test_duplicate_ids_share_one_batch(self):
+        drive = FakeDrive(['a', 'b'])
+        _, deleted = self.run_queue(drive, ['a', 'b', 'a'])
+        self.assertEqual(drive.batches, [['a', 'b']])
+        self.assertEqual(sorted(deleted), ['a', 'b'])
+
+    def test_already_deleted_counts_as_deleted(self):
+        drive = FakeDrive(['a'])
+        _, deleted = self.run_queue(drive, ['a', 'gone'])
+        self.assertEqual(sorted(deleted), ['a', 'gone'])
+        self.assertEqual(drive.single, [])
+
+    def test_failed_sub_requests_are_retried_individually(self):
+        drive = FakeDrive(['a', 'b', 'c'], fail_in_batch=['b'], fail_always=['c'])
+        _, deleted = self.run_queue(drive, ['a', 'b', 'c'])
+        self.assertEqual(sorted(deleted), ['a', 'b'])
+        self.assertEqual(sorted(drive.single), ['b', 'c'])
+        self.assertEqual(drive.alive, {'c'})
+
+@mock.patch.object(GooglePull, 'thread_http', lambda service: None)
+class DeleteEmptyFoldersTest(unittest.TestCase):
+    def test_only_folders_listed_empty_are_deleted_deepest_first(self):
+        manifest, positions = build_tree({'sub': {'a': None, 'deep': {'b': None}}, 'late': {'c': None}})
+        for name in ('a', 'b', 'c'):
+            manifest.mark_deleted(positions[name])
+        drive = FakeDrive(['root', 'id-sub', 'id-deep', 'id-late'])
+        listings = {'id-late': [{'id': 'added-after-the-crawl'}]}
+
+        def iter_sources(service, folder_id, resource_key=None, http=None):
+            # A folder lists as empty once its subfolders are gone from the fake drive
+            children = [position for position in manifest.children[manifest.index[folder_id]]
+                        if manifest.records[position].is_folder]
+            yield from listings.get(folder_id, [])
+            yield from ({'id': manifest.records[child].id} for child in children
+                        if manifest.records[child].id in drive.alive)
+
+        delete_queue = DeleteQueue(drive, lambda item_id: manifest.mark_deleted(manifest.index[item_id]),
+                                   workers=1, linger=0.01)
+        with mock.patch.object(GooglePull, 'iter_sources', iter_sources):
+            delete_empty_folders(None, manifest, list(manifest.folders()), delete_queue)
+        delete_queue.close()
+        self.assertEqual(drive.alive, {'root', 'id-late'})
+        self.assertEqual(drive.batches, [['id-deep'], ['id-sub']])
+
+class LocalNamesTest(unittest.TestCase):
+    def test_later_duplicates_get_their_id(self):
+        manifest, positions = build_tree({'x.txt': None, 'sub': {}, 'y.txt': None})
+        twin = manifest.append(DriveItem('twin', 0, 'X.TXT', mime=FILE_MIME))
+        self.assertEqual(local_names(manifest, 0), {
+            positions['x.txt']: 'x.txt', positions['y.txt']: 'y.txt', twin: 'X (twin).TXT'})
+
+    def test_extending_keeps_names_already_handed_out(self):
+        manifest, positions = build_tree({'x.txt': None})
+        names = local_names(manifest, 0)
+        twin = manifest.append(DriveItem('twin', 0, 'x.txt', mime=FILE_MIME))
+        self.assertEqual(local_names(manifest, 0, names), {positions['x.txt']: 'x.txt', twin: 'x (twin).txt'})
+
+    def download_names(self, manifest, **kwargs):
+        """
+        Run download_files with a stand-in download_file; returns {id: local name}.
+        """
+        names = {}
+
+        def fake_download(service, item, folder_path, progress, name=None, **ignored):
+            names[item.id] = name
+            return True
+        with tempfile.TemporaryDirectory() as dest, mock.patch.object(GooglePull, 'download_file', fake_download):
+            download_files(None, manifest, Path(dest), **kwargs)
+        return names
+
+    def test_retry_pass_names_duplicates_as_the_full_pass_did(self):
+        manifest = Manifest('root', 'root')
+        first = manifest.append(DriveItem('idA', 0, 'x.txt', mime=FILE_MIME))
+        second = manifest.append(DriveItem('idB', 0, 'x.txt', mime=FILE_MIME))
+        self.assertEqual(self.download_names(manifest), {'idA': 'x.txt', 'idB': 'x (idB).txt'})
+
+        # A was verified and deleted from Drive; only B is retried
+        manifest.verified[first] = 1
+        manifest.mark_deleted(first)
+        self.assertEqual(self.download_names(manifest, positions=[second]), {'idB': 'x (idB).txt'})
+
+class Interrupted(Exception):
+    """
+    Stands in for the process being killed mid-transfer; not a transient error, so nothing retries it.
+    """
+
+class FakeMediaHttp:
+    """
+    Serves Range requests for one file's content, failing every request after the first `fail_after`.
+    """
+    def __init__(self, content, fail_after=None):
+        self.content = content
+        self.fail_after = fail_after
+        self.ranges = []
+        self.lock = threading.Lock()
+
+    def request(self, uri, method='GET', headers=None, **kwargs):
+        start, end = (int(bound) for bound in headers['range'][len('bytes='):].split('-'))
+        with self.lock:
+            if self.fail_after is not None and len(self.ranges) >= self.fail_after:
+                raise Interrupted()
+            self.ranges.append((start, end))
+        return FakeResponse(206), self.content[start:end + 1]
+
+    def fetched(self):
+        return sum(end + 1 - start for start, end in self.ranges)
+
+class FakeTransfer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.updated = self.skipped = 0
+
+    def update(self, count):
+        with self.lock:
+            self.updated += count
+
+    def skip(self, count):
+        self.skipped += count
+
+class MediaRequest:
+    def __init__(self, http):
+        self.uri = 'https://example.invalid/media'
+        self.headers = {}
+        self.http = http
+
+@mock.patch.object(GooglePull, 'CHUNK_SIZE', 100)
+class ResumeTest(unittest.TestCase):
+    content = bytes(range(256)) * 8
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.part_path = Path(self.tmp.name) / 'f.bin.f.part'
+        self.item = DriveItem('f', 0, 'f.bin', len(self.content), hashlib.md5(self.content).digest(), mime=FILE_MIME)
+
+    def segmented(self, http, segments=4):
+        transfer = FakeTransfer()
+        with mock.patch.object(GooglePull, 'thread_http', lambda service: http):
+            download_segmented(None, MediaRequest(http), self.item, self.part_path, segments, transfer)
+        return transfer
+
+    def test_single_stream_resumes_at_the_checkpoint(self):
+        http = FakeMediaHttp(self.content, fail_after=3)
+        with self.assertRaises(Interrupted):
+            download_media(MediaRequest(http), self.item, self.part_path, hashlib.md5(), FakeTransfer())
+        self.assertEqual(read_checkpoint(self.part_path, self.item)['offset'], 300)
+
+        http = FakeMediaHttp(self.content)
+        hasher, transfer = hashlib.md5(), FakeTransfer()
+        download_media(MediaRequest(http), self.item, self.part_path, hasher, transfer)
+        self.assertEqual(http.ranges[0][0], 300)
+        self.assertEqual((transfer.skipped, transfer.updated), (300, len(self.content) - 300))
+        self.assertEqual(hasher.digest(), self.item.md5)
+        self.assertEqual(self.part_path.read_bytes(), self.content)
+        self.assertFalse(sidecar_path(self.part_path).exists())
+
+    def test_checkpoint_for_another_revision_is_ignored(self):
+        self.part_path.write_bytes(self.content[:500])
+        write_checkpoint(self.part_path, self.item, offset=500)
+        self.item.md5 = hashlib.md5(b'changed').digest()
+        self.assertIsNone(read_checkpoint(self.part_path, self.item))
+
+    def test_segments_resume_without_fetching_any_byte_twice(self):
+        first = FakeMediaHttp(self.content, fail_after=6)
+        with self.assertRaises(Interrupted):
+            self.segmented(first)
+        self.assertTrue(read_checkpoint(self.part_path, self.item)['segments'])
+
+        second = FakeMediaHttp(self.content)
+        transfer = self.segmented(second)
+        self.assertEqual(self.part_path.read_bytes(), self.content)
+        self.assertEqual(first.fetched() + second.fetched(), len(self.content))
+        self.assertEqual((transfer.skipped, transfer.updated), (first.fetched(), second.fetched()))
+        self.assertFalse(sidecar_path(self.part_path).exists())
+
+    def test_single_stream_checkpoint_resumes_as_segments(self):
+        with self.assertRaises(Interrupted):
+            download_media(MediaRequest(FakeMediaHttp(self.content, fail_after=5)), self.item, self.part_path,
+                           None, FakeTransfer())
+        http = FakeMediaHttp(self.content)
+        self.segmented(http)
+        self.assertEqual(self.part_path.read_bytes(), self.content)
+        self.assertEqual(min(start for start, _ in http.ranges), 500)
+
+    def test_fully_checkpointed_file_is_not_fetched_again(self):
+        self.part_path.write_bytes(self.content)
+        write_checkpoint(self.part_path, self.item, offset=len(self.content))
+        http = FakeMediaHttp(self.content)
+        transfer = self.segmented(http)
+        self.assertEqual(http.ranges, [])
+        self.assertEqual(transfer.skipped, len(self.content))
+        self.assertEqual(self.part_path.read_bytes(), self.content)
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dest = Path(self.tmp.name)
+
+    def test_replay_restores_manifest_and_progress(self):
+        manifest, positions = build_tree({'a': None, 'sub': {'b': None}, 'c': None, 'lost': {}})
+        manifest.records[positions['a']].md5 = hashlib.md5(b'a').digest()
+        manifest.incomplete.add(positions['lost'])
+        manifest.crawled_at = 1000.0
+        journal = Journal(self.dest)
+        journal.start('root', 'root')
+        journal.record(positions['a'], VERIFIED)  # downloads start while the crawl is still running
+        journal.save_manifest(manifest)
+        journal.record(positions['sub'], DELETED)
+        journal.close()
+
+        journal = Journal(self.dest)
+        self.addCleanup(journal.close)
+        self.assertIsNone(journal.load('another-root'))
+        replay = journal.load('root')
+        self.assertEqual([record.id for record in replay.records], [record.id for record in manifest.records])
+        self.assertEqual(replay.records[positions['a']].md5, hashlib.md5(b'a').digest())
+        self.assertEqual(replay.crawled_at, 1000.0)
+        self.assertEqual(replay.incomplete, {positions['lost']})
+        self.assertTrue(replay.verified[positions['a']])
+        self.assertTrue(replay.deleted[positions['b']])
+        self.assertEqual(replay.remaining(), [positions['a'], positions['c']])
+
+        journal.finish()
+        self.assertIsNone(journal.load('root'))
+
+    def test_unfinished_crawl_is_not_replayed(self):
+        journal = Journal(self.dest)
+        self.addCleanup(journal.close)
+        journal.start('root', 'root')
+        self.assertIsNone(journal.load('root'))
+
+class RecheckSourceTest(unittest.TestCase):
+    def test_each_item_retries_on_its_own_schedule_until_it_succeeds_or_runs_out(self):
+        manifest, positions = build_tree({'flaky': None, 'broken': None, 'lost': {}})
+        manifest.incomplete.add(positions['lost'])
+        clock = [0.0]
+        rounds = []
+
+        def fake_download_files(service, manifest, dest_folder, journal=None, positions=(), **settings):
+            rounds.append((clock[0], [manifest.records[position].name for position in positions]))
+            for position in positions:
+                name = manifest.records[position].name
+                tries = sum(name in names for _, names in rounds)
+                if name == 'found' or (name == 'flaky' and tries == 3):
+                    manifest.mark_deleted(position)
+
+        def fake_relist(service, manifest, folders, batch_size=1):
+            for folder in folders:
+                manifest.incomplete.discard(folder)
+                manifest.append(DriveItem('id-found', folder, 'found', mime=FILE_MIME))
+            return set()
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        config = configparser.ConfigParser()['DEFAULT']
+        with mock.patch.object(GooglePull, 'download_files', fake_download_files), \
+                mock.patch.object(GooglePull, 'relist_folders', fake_relist), \
+                mock.patch.object(GooglePull, 'retry_policy', RetryPolicy(budget=10000)), \
+                mock.patch.object(GooglePull.time, 'monotonic', lambda: clock[0]), \
+                mock.patch.object(GooglePull.time, 'sleep', sleep):
+            recheck_source(None, manifest, Path(self.tmp_dest()), config, max_retry=4)
+
+        tries = {name: sum(name in names for _, names in rounds) for name in ('flaky', 'broken', 'found')}
+        self.assertEqual(tries, {'flaky': 3, 'broken': 4, 'found': 1})
+        self.assertEqual(manifest.remaining(), [positions['broken']])
+        self.assertFalse(manifest.incomplete)
+        times = [when for when, names in rounds if 'broken' in names]
+        self.assertEqual(times, sorted(times))
+
+    def tmp_dest(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return tmp.name
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file